@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import argparse
+import ast
+import json
+import logging
+import timeit
+
+from src.convert import extract_copy_numbers
+
+logging.getLogger('src.convert').setLevel(logging.WARNING)
+
+
+def build_payload(alterations):
+    copy_numbers = []
+    for i in range(alterations):
+        copy_numbers.append({
+            '@gene': 'GENE%d' % i,
+            '@position': 'chr%d:%d-%d' % (i % 22 + 1, 1000 * i, 1000 * i + 500),
+            '@copy-number': str(i % 50),
+            '@equivocal': 'true' if i % 2 else 'false',
+            '@ratio': '2.17',
+            '@status': 'known',
+            '@type': 'amplification' if i % 3 else 'loss',
+            '@number-of-exons': '5 of 5',
+            'dna-evidence': {'@sample': 'SA-1612348'}
+        })
+
+    return {'variant-report': {'samples': {'sample': {'@name': 'SA-1612348'}},
+                               'copy-number-alterations': {'copy-number-alteration': copy_numbers}}}
+
+
+def extract_with_round_trip(payload):
+    # The per-row json.dumps/ast.literal_eval copy extract_copy_numbers used to make
+    cnv_dict = extract_copy_numbers(payload)
+    return {'CopyNumbers': [ast.literal_eval(json.dumps(cnv)) for cnv in cnv_dict['CopyNumbers']]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the per-row cost of extract_copy_numbers.')
+    parser.add_argument('-n', '--alterations', dest='alterations', type=int, default=5000)
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    payload = build_payload(args.alterations)
+    assert extract_copy_numbers(payload) == extract_with_round_trip(payload)
+
+    for name, func in [('json/literal_eval round trip', extract_with_round_trip),
+                       ('direct construction', extract_copy_numbers)]:
+        best = min(timeit.repeat(lambda func=func: func(payload), number=1, repeat=args.repeat))
+        print('%-30s %8.2f us/row' % (name, best * 1e6 / args.alterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+import argparse
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic_report import write_report
+from src.batch import collect_batch, extract_one
+
+logging.getLogger('src.convert').setLevel(logging.WARNING)
+
+
+def collect_without_interning(reports, args):
+    rows = []
+    for report in reports:
+        rows.extend(extract_one(report, args)[1])
+    return rows
+
+
+def held_bytes(collect):
+    # Only what is still allocated once collection returns counts; parse trees have been freed by then
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        rows = collect()
+        seconds = time.perf_counter() - start
+        return rows, tracemalloc.get_traced_memory()[0], seconds
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the memory held by the rows of a synthetic cohort with '
+                                                 'and without batch-scoped interning.')
+    parser.add_argument('-c', '--reports', dest='reports', type=int, default=50)
+    parser.add_argument('-n', '--alterations', dest='alterations', type=int, default=500)
+    parser.add_argument('-s', '--samples', dest='samples', type=int, default=2)
+    args = parser.parse_args()
+
+    batch_args = argparse.Namespace(stream=False, jobs=1, mapping_file=None, merge_file=None, cache_dir=None,
+                                    prescan=False, parser='xmltodict')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        reports = []
+        for i in range(args.reports):
+            xml_file = os.path.join(tmp_dir, 'report%d.xml' % i)
+            write_report(xml_file, alterations=args.alterations, samples=args.samples, seed=i)
+            reports.append((xml_file, None))
+
+        plain_rows, plain_bytes, plain_seconds = held_bytes(lambda: collect_without_interning(reports, batch_args))
+        del plain_rows
+        interned_rows, interned_bytes, interned_seconds = held_bytes(lambda: collect_batch(reports, batch_args)[1])
+
+    rows = len(interned_rows)
+    print('%-20s %12s %12s' % ('', 'bytes/row', 'ms'))
+    print('%-20s %12.1f %12.1f' % ('without interning', plain_bytes / rows, plain_seconds * 1e3))
+    print('%-20s %12.1f %12.1f' % ('with interning', interned_bytes / rows, interned_seconds * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module):
+    # Each run is a fresh interpreter, so every import is measured cold
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=ROOT_DIR,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def command_seconds(command):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + command, cwd=ROOT_DIR, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the cold import time of a module with python -X importtime '
+                                                 'and the wall time of the convert command line.')
+    parser.add_argument('-m', '--module', dest='module', default='src.convert')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=5)
+    parser.add_argument('-t', '--top', dest='top', type=int, default=10,
+                        help='Number of slowest imports (by their own time) to list')
+    parser.add_argument('--max-ms', dest='max_ms', type=float,
+                        help='Exit non-zero when the best import time of the module exceeds this many milliseconds')
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    best = min(runs, key=lambda times: times[args.module][1])
+    import_ms = best[args.module][1] / 1e3
+    help_ms = min(command_seconds(['-m', 'src', '--help']) for _ in range(args.repeat)) * 1e3
+
+    print('%-40s %10.2f ms' % ('import ' + args.module, import_ms))
+    print('%-40s %10.2f ms' % ('python -m src --help', help_ms))
+    for name, (self_us, _) in sorted(best.items(), key=lambda item: -item[1][0])[:args.top]:
+        print('  %-38s %10.2f ms' % (name, self_us / 1e3))
+
+    if args.max_ms is not None and import_ms > args.max_ms:
+        print('REGRESSION import %s took %.2fms, over the %.2fms budget' % (args.module, import_ms, args.max_ms))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
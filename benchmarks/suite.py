@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+from benchmarks.synthetic_report import write_report
+from src.convert import extract_copy_numbers, read_xml, write_copy_numbers_to_cnv
+
+logging.getLogger('src.convert').setLevel(logging.WARNING)
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(func, repeat):
+    return {'seconds': min(timeit.repeat(func, number=1, repeat=repeat)),
+            'peak_bytes': peak_memory(func)}
+
+
+def run_case(xml_file, out_file, alterations, repeat):
+    args = argparse.Namespace(out_file=out_file, format='csv')
+    payload = read_xml(xml_file)['rr:ResultsReport']['rr:ResultsPayload']
+    cnv_dict = extract_copy_numbers(payload)
+    xml_bytes = os.path.getsize(xml_file)
+
+    stages = {
+        'read_xml': measure(lambda: read_xml(xml_file), repeat),
+        'read_xml_stream': measure(lambda: read_xml(xml_file, stream=True), repeat),
+        'read_xml_expat': measure(lambda: read_xml(xml_file, parser='expat'), repeat),
+        'extract_copy_numbers': measure(lambda: extract_copy_numbers(payload), repeat),
+        'write_copy_numbers_to_cnv': measure(lambda: write_copy_numbers_to_cnv(cnv_dict, args), repeat),
+    }
+    for stage in stages.values():
+        stage['rows_per_second'] = alterations / stage['seconds']
+    for stage in ['read_xml', 'read_xml_stream', 'read_xml_expat']:
+        stages[stage]['mb_per_second'] = xml_bytes / stages[stage]['seconds'] / 1e6
+
+    return {'xml_bytes': xml_bytes, 'stages': stages}
+
+
+def run_suite(alteration_counts, sample_counts, payload_bytes, repeat):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for alterations in alteration_counts:
+            for samples in sample_counts:
+                name = 'alterations=%d,samples=%d,payload=%d' % (alterations, samples, payload_bytes)
+                xml_file = os.path.join(tmp_dir, 'report.xml')
+                write_report(xml_file, alterations=alterations, samples=samples, payload_bytes=payload_bytes)
+                results[name] = run_case(xml_file, os.path.join(tmp_dir, 'report.csv'), alterations, repeat)
+
+    return results
+
+
+def print_results(results):
+    print('%-45s %-26s %10s %12s %12s' % ('case', 'stage', 'ms', 'rows/s', 'peak MB'))
+    for name, case in results.items():
+        for stage, timing in case['stages'].items():
+            print('%-45s %-26s %10.2f %12.0f %12.2f' % (name, stage, timing['seconds'] * 1e3,
+                                                        timing['rows_per_second'], timing['peak_bytes'] / 1e6))
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for name, case in results.items():
+        for stage, timing in case['stages'].items():
+            previous = baseline.get(name, {}).get('stages', {}).get(stage)
+            if previous and timing['seconds'] > previous['seconds'] * (1 + tolerance):
+                regressions.append('%s %s: %.2fms -> %.2fms' % (name, stage, previous['seconds'] * 1e3,
+                                                                timing['seconds'] * 1e3))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times read_xml, extract_copy_numbers and write_copy_numbers_to_cnv '
+                                                 'on synthetic FoundationOne reports.')
+    parser.add_argument('-n', '--alterations', dest='alterations', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('-s', '--samples', dest='samples', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('-p', '--payload-bytes', dest='payload_bytes', type=int, default=1000000)
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3)
+    parser.add_argument('--save', dest='save_file', help='Write the results to this JSON baseline')
+    parser.add_argument('--compare', dest='baseline_file', help='JSON baseline to check for regressions against')
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default=0.2,
+                        help='Allowed slowdown against the baseline before a stage counts as a regression')
+    args = parser.parse_args()
+
+    results = run_suite(args.alterations, args.samples, args.payload_bytes, args.repeat)
+    print_results(results)
+
+    if args.save_file:
+        with open(args.save_file, 'w') as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+
+    if args.baseline_file:
+        with open(args.baseline_file) as fd:
+            regressions = find_regressions(results, json.load(fd), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
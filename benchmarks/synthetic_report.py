@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+import argparse
+import base64
+import os
+import random
+
+COPY_TYPES = ['amplification', 'loss', 'partial amplification']
+STATUSES = ['known', 'likely', 'unknown', 'ambiguous']
+
+
+def generate_samples(samples):
+    lines = ['      <samples>']
+    for i in range(samples):
+        nucleic_acid_type = 'DNA' if i % 2 == 0 else 'RNA'
+        lines.append('        <sample bait-set="D2" mean-exon-depth="811.98" name="SA-%07d" nucleic-acid-type="%s"/>'
+                     % (i, nucleic_acid_type))
+    lines.append('      </samples>')
+    return lines
+
+
+def generate_copy_numbers(alterations, samples, rng):
+    lines = ['      <copy-number-alterations>']
+    for i in range(alterations):
+        start = rng.randrange(1, 200000000)
+        sample = 'SA-%07d' % (2 * rng.randrange((samples + 1) // 2))
+        lines.append('        <copy-number-alteration copy-number="%d" equivocal="%s" gene="GENE%d" '
+                     'number-of-exons="%d of %d" position="chr%d:%d-%d" ratio="%.2f" status="%s" type="%s">'
+                     % (rng.randrange(0, 60), rng.choice(['true', 'false']), i, 5, 7, rng.randrange(1, 23),
+                        start, start + rng.randrange(1000, 100000), rng.uniform(0, 12), rng.choice(STATUSES),
+                        rng.choice(COPY_TYPES)))
+        lines.append('          <dna-evidence sample="%s"/>' % sample)
+        lines.append('        </copy-number-alteration>')
+    lines.append('      </copy-number-alterations>')
+    return lines
+
+
+def generate_short_variants(short_variants, rng):
+    lines = ['      <short-variants>']
+    for i in range(short_variants):
+        lines.append('        <short-variant allele-fraction="%.3f" cds-effect="229C&gt;A" depth="%d" '
+                     'functional-effect="missense" gene="GENE%d" position="chr%d:%d" protein-effect="R77S" '
+                     'status="known" transcript="NM_%06d">'
+                     % (rng.random(), rng.randrange(100, 1000), i, rng.randrange(1, 23), rng.randrange(1, 2 ** 27), i))
+        lines.append('          <dna-evidence sample="SA-0000000"/>')
+        lines.append('        </short-variant>')
+    lines.append('      </short-variants>')
+    return lines
+
+
+def generate_report(alterations=1000, samples=1, payload_bytes=0, short_variants=None, seed=0):
+    rng = random.Random(seed)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<rr:ResultsReport xmlns:rr="http://integration.foundationmedicine.com/reporting">',
+             '  <rr:ResultsPayload>',
+             '    <FinalReport><PMI><LastName>doe</LastName><FirstName>jane</FirstName></PMI></FinalReport>',
+             '    <variant-report xmlns="http://foundationmedicine.com/compbio/variant-report-external">']
+    lines += generate_samples(samples)
+    lines += generate_short_variants(alterations if short_variants is None else short_variants, rng)
+    lines += generate_copy_numbers(alterations, samples, rng)
+    lines += ['      <rearrangements/>',
+              '      <biomarkers><microsatellite-instability status="MSS"/></biomarkers>',
+              '    </variant-report>',
+              '    <ReportPDF>%s</ReportPDF>' % base64.b64encode(os.urandom(payload_bytes)).decode('ascii'),
+              '  </rr:ResultsPayload>',
+              '</rr:ResultsReport>']
+    return '\n'.join(lines) + '\n'
+
+
+def write_report(xml_file, **kwargs):
+    with open(xml_file, 'w') as fd:
+        fd.write(generate_report(**kwargs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates a synthetic FoundationOne XML report.')
+    parser.add_argument('-o', '--output', dest='xml_file', required=True)
+    parser.add_argument('-n', '--alterations', dest='alterations', type=int, default=1000)
+    parser.add_argument('-s', '--samples', dest='samples', type=int, default=1,
+                        help='Number of samples, alternating DNA and RNA')
+    parser.add_argument('-p', '--payload-bytes', dest='payload_bytes', type=int, default=0,
+                        help='Size of the base64 encoded PDF payload before encoding')
+    args = parser.parse_args()
+
+    write_report(args.xml_file, alterations=args.alterations, samples=args.samples, payload_bytes=args.payload_bytes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+import argparse
+import logging
+import timeit
+import tracemalloc
+
+from benchmarks.extract_copy_numbers import build_payload
+from src.convert import iter_copy_numbers
+from src.table import CopyNumberTable
+
+logging.getLogger('src.convert').setLevel(logging.WARNING)
+
+
+def traced_size(build):
+    tracemalloc.start()
+    try:
+        result = build()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the memory held by extracted rows as dicts and as a '
+                                                 'CopyNumberTable, and times the table filters.')
+    parser.add_argument('-n', '--alterations', dest='alterations', type=int, default=5000)
+    parser.add_argument('-c', '--reports', dest='reports', type=int, default=20)
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    payload = build_payload(args.alterations)
+    rows_count = args.alterations * args.reports
+    rows, dict_bytes = traced_size(lambda: [cnv for _ in range(args.reports) for cnv in iter_copy_numbers(payload)])
+    table, table_bytes = traced_size(lambda: CopyNumberTable.from_dicts(
+        cnv for _ in range(args.reports) for cnv in iter_copy_numbers(payload)))
+    assert len(rows) == len(table)
+
+    print('%-20s %12.1f bytes/row' % ('dicts', dict_bytes / rows_count))
+    print('%-20s %12.1f bytes/row' % ('CopyNumberTable', table_bytes / rows_count))
+    for name, func in [('select gene', lambda: table.select(gene='GENE7')),
+                       ('select status', lambda: table.select(status='amplification')),
+                       ('overlapping', lambda: table.overlapping('chr12', 0, 10 ** 6)),
+                       ('dict scan gene', lambda: [cnv for cnv in rows if cnv['gene'] == 'GENE7'])]:
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print('%-20s %12.2f ms' % (name, best * 1e3))
+
+
+if __name__ == '__main__':
+    main()
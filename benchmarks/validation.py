@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+import argparse
+import gc
+import logging
+import sys
+import time
+
+from benchmarks.synthetic_report import generate_report
+from src.convert import extract_copy_numbers, parse_xml
+from src.validation import pop_validation_errors
+
+logging.getLogger('src.convert').setLevel(logging.WARNING)
+
+
+def build_payload(alterations, parser, invalid_every=0):
+    xml_bytes = generate_report(alterations=alterations, short_variants=0).encode('utf-8')
+    payload = parse_xml(xml_bytes, parser=parser)['rr:ResultsReport']['rr:ResultsPayload']
+    if invalid_every:
+        copy_numbers = payload['variant-report']['copy-number-alterations']['copy-number-alteration']
+        for copy_number in copy_numbers[::invalid_every]:
+            del copy_number['@copy-number']
+    return payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the cost of validating alterations during extraction '
+                                                 'against unvalidated extraction of the same parsed report.')
+    parser.add_argument('-n', '--alterations', dest='alterations', type=int, default=5000)
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=15)
+    parser.add_argument('--parser', dest='parser', choices=['xmltodict', 'expat'], default='expat')
+    parser.add_argument('--invalid-every', dest='invalid_every', type=int, default=100,
+                        help='Also time lenient extraction of a report where every Nth alteration is invalid')
+    parser.add_argument('--max-overhead', dest='max_overhead', type=float,
+                        help='Exit non-zero when strict validation is more than this many percent slower')
+    args = parser.parse_args()
+
+    payload = build_payload(args.alterations, args.parser)
+    invalid_payload = build_payload(args.alterations, args.parser, args.invalid_every)
+    assert extract_copy_numbers(payload, validation=None) == extract_copy_numbers(payload)
+
+    runs = [('unvalidated', payload, None), ('strict', payload, 'strict'), ('lenient', payload, 'lenient'),
+            ('lenient, 1 in %d invalid' % args.invalid_every, invalid_payload, 'lenient')]
+    best = {}
+    # Rounds interleave the runs so machine noise hits all of them alike; collection is paused as in timeit
+    gc.disable()
+    for _ in range(args.repeat):
+        for name, run_payload, validation in runs:
+            start = time.perf_counter()
+            extract_copy_numbers(run_payload, validation=validation)
+            best[name] = min(best.get(name, float('inf')), time.perf_counter() - start)
+            pop_validation_errors()
+    gc.enable()
+
+    for name, _, _ in runs:
+        print('%-30s %8.2f us/row %+7.2f%%' % (name, best[name] * 1e6 / args.alterations,
+                                               (best[name] / best['unvalidated'] - 1) * 100))
+
+    overhead = (best['strict'] / best['unvalidated'] - 1) * 100
+    if args.max_overhead is not None and overhead > args.max_overhead:
+        print('REGRESSION strict validation added %.2f%%, over the %.2f%% budget' % (overhead, args.max_overhead))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
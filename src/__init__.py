@@ -0,0 +1,39 @@
+import importlib
+import logging
+
+LOG_FORMAT = '[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s'
+
+# Public names and the modules they live in; each module is only imported when one of its names is first used
+EXPORTS = {
+    'extract_copy_numbers': 'src.convert',
+    'iter_copy_numbers': 'src.convert',
+    'read_copy_numbers': 'src.convert',
+    'read_xml': 'src.convert',
+    'parse_xml': 'src.convert',
+    'load_mappings': 'src.convert',
+    'write_copy_numbers_to_cnv': 'src.convert',
+    'read_sections': 'src.sections',
+    'OUTPUT_WRITERS': 'src.convert',
+    'convert_batch': 'src.batch',
+    'convert_many_async': 'src.batch',
+    'merge_batch': 'src.batch',
+    'collect_batch': 'src.batch',
+    'interning': 'src.interning',
+    'CopyNumberTable': 'src.table',
+    'IntervalIndex': 'src.index',
+    'ResultCache': 'src.cache',
+    'metrics': 'src.metrics',
+}
+
+__all__ = sorted(EXPORTS) + ['configure_logging']
+
+
+def configure_logging(level=logging.INFO):
+    # Only the command line entry points configure logging; importing the package leaves it to the caller
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+
+
+def __getattr__(name):
+    if name not in EXPORTS:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    return getattr(importlib.import_module(EXPORTS[name]), name)
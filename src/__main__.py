@@ -0,0 +1,23 @@
+import importlib
+import sys
+
+COMMANDS = {
+    'convert': 'src.convert',
+    'batch': 'src.batch',
+    'server': 'src.server',
+    'index': 'src.index',
+}
+
+
+def main():
+    # Only the module of the requested command is imported; without a command the arguments go to convert
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        command = sys.argv.pop(1)
+    else:
+        command = 'convert'
+    sys.argv[0] = 'python -m src %s' % command
+    importlib.import_module(COMMANDS[command]).main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,454 @@
+import argparse
+import asyncio
+import csv
+import glob
+import hashlib
+import json
+import logging
+import os
+import sys
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from src import configure_logging
+from src.cache import ResultCache, hash_file
+from src.convert import (BINARY_FORMATS, OUTPUT_WRITERS, SAMPLE_MODES, SECTIONS, XML_PARSERS, all_samples,
+                         cnv_fields, contains_copy_numbers, convert_report, iter_copy_numbers, load_mappings, parse_xml,
+                         pop_unresolved_values, read_copy_numbers, report_unresolved_values, validation_mode,
+                         write_copy_numbers_to_cnv)
+from src.index import build_index
+from src.inputs import (REPORT_EXTENSIONS, is_archive, iter_archive, list_archive, preloaded, read_input, report_stem,
+                        split_member)
+from src.interning import interner, interning
+from src.journal import Journal
+from src.metrics import metrics, profiled
+from src.validation import VALIDATION_MODES, pop_validation_errors, report_validation_errors
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FIELDS = ['xml_file', 'out_file', 'status', 'error']
+
+
+def find_reports(xml_input, output_dir, extension='.csv'):
+    if os.path.isdir(xml_input):
+        xml_files = sorted(xml_file for report_extension in REPORT_EXTENSIONS
+                           for xml_file in glob.glob(os.path.join(xml_input, '*' + report_extension)))
+    elif os.path.isfile(xml_input) and is_archive(xml_input):
+        xml_files = list_archive(xml_input)
+    else:
+        xml_files = sorted(glob.glob(xml_input))
+
+    return [(xml_file, os.path.join(output_dir, report_stem(xml_file) + extension)) for xml_file in xml_files]
+
+
+def shared_outputs(reports):
+    # Outputs that several reports map to (r.xml and r.xml.gz, or a/report.xml and b/report.xml in an archive);
+    # the later report would silently replace the earlier one
+    counts = Counter(os.path.normpath(out_file) for _, out_file in reports if out_file != '-')
+    return sorted(out_file for out_file, count in counts.items() if count > 1)
+
+
+def read_manifest(manifest_file):
+    with open(manifest_file) as fd:
+        return [(row[0].strip(), row[1].strip()) for row in csv.reader(fd) if row]
+
+
+def start_report(args):
+    if getattr(args, 'metrics_file', None):
+        metrics.enable()
+
+
+def finish_report(result):
+    # Worker processes hand their per-report counts back with the result
+    result['unresolved'] = pop_unresolved_values()
+    result['invalid'] = pop_validation_errors()
+    result['metrics'] = metrics.pop()
+    return result
+
+
+def read_archive(archive):
+    # An unreadable archive is left to the workers, which fail its reports one by one
+    try:
+        yield from iter_archive(archive)
+    except Exception as ex:
+        logger.error('Failed to read %s: %s', archive, ex)
+
+
+def iter_contents(reports):
+    # Archive members are read in one sequential pass per archive and handed to the workers with the report;
+    # other reports are opened by the worker itself and come with None. Members listed ahead of their archive
+    # order (a manifest) are kept in memory from that pass until their turn, and members the archive does not
+    # have come with None, so the worker reports them
+    reports = list(reports)
+    wanted = Counter(report[0] for report in reports if split_member(report[0])[1] is not None)
+    remaining = Counter(split_member(xml_file)[0] for xml_file in wanted.elements())
+    passes = {}
+    for report in reports:
+        xml_file = report[0]
+        archive, member = split_member(xml_file)
+        if member is None:
+            yield report, None
+            continue
+
+        members, read_ahead = passes.setdefault(archive, (read_archive(archive), {}))
+        data = read_ahead.pop(xml_file, None)
+        while data is None:
+            member_file, member_data = next(members, (None, None))
+            if member_file is None:
+                break
+            if member_file == xml_file:
+                data = member_data
+            elif wanted[member_file]:
+                read_ahead[member_file] = member_data
+
+        wanted[xml_file] -= 1
+        if wanted[xml_file] and data is not None:
+            read_ahead[xml_file] = data
+        remaining[archive] -= 1
+        if not remaining[archive]:
+            members.close()
+            del passes[archive]
+        yield report, data
+
+
+def journal_hash(xml_file, data, args):
+    # Archive members are hashed from memory for the journal, which would otherwise reopen the archive
+    if data is None or not getattr(args, 'journal_file', None):
+        return None
+    with preloaded(xml_file, data):
+        return hash_file(xml_file)
+
+
+def convert_one(report, args, data=None):
+    xml_file, out_file = report
+    start_report(args)
+    try:
+        with preloaded(xml_file, data):
+            convert_report(xml_file, argparse.Namespace(**dict(vars(args), out_file=out_file)))
+        result = {'xml_file': xml_file, 'out_file': out_file, 'status': 'success', 'error': ''}
+    except Exception as ex:
+        logger.error('Failed to convert %s: %s', xml_file, ex)
+        result = {'xml_file': xml_file, 'out_file': out_file, 'status': 'failure', 'error': repr(ex)}
+
+    result['sha256'] = journal_hash(xml_file, data, args)
+    return finish_report(result)
+
+
+def extract_one(report, args, data=None):
+    xml_file, _ = report
+    start_report(args)
+    try:
+        with preloaded(xml_file, data):
+            rows = [dict(cnv, source_file=xml_file) for cnv in read_copy_numbers(xml_file, args)]
+        result = {'xml_file': xml_file, 'out_file': args.merge_file, 'status': 'success', 'error': ''}
+    except Exception as ex:
+        logger.error('Failed to convert %s: %s', xml_file, ex)
+        rows = []
+        result = {'xml_file': xml_file, 'out_file': args.merge_file, 'status': 'failure', 'error': repr(ex)}
+
+    return finish_report(result), rows
+
+
+def run_in_order(func, reports, args):
+    jobs = getattr(args, 'jobs', 1)
+    if jobs <= 1:
+        for report, data in iter_contents(reports):
+            yield func(report, args, data)
+        return
+
+    # Results are yielded in submission order, and at most two reports per worker are
+    # queued or being parsed at any time, so memory stays bounded on large backlogs.
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for report, data in iter_contents(reports):
+            if len(pending) >= jobs * 2:
+                yield pending.popleft().result()
+            pending.append(executor.submit(func, report, args, data))
+        while pending:
+            yield pending.popleft().result()
+
+
+def convert_batch(reports, args, journal=None):
+    results = []
+    for result in run_in_order(convert_one, reports, args):
+        if journal:
+            journal.record(result)
+        results.append(result)
+
+    return results
+
+
+def skipped_result(report):
+    return {'xml_file': report[0], 'out_file': report[1], 'status': 'skipped', 'error': '', 'unresolved': {},
+            'invalid': [], 'metrics': {'stages': {}, 'counters': {}}}
+
+
+def merge_batch(reports, args):
+    results = []
+
+    def merged_rows():
+        for result, rows in run_in_order(extract_one, reports, args):
+            results.append(result)
+            yield from rows
+
+    logger.info('Saving copy numbers from %d reports to %s', len(reports), args.merge_file)
+    with metrics.timer('write_copy_numbers_to_cnv'):
+        OUTPUT_WRITERS[args.format](merged_rows(), args.merge_file, cnv_fields(args) + ['source_file'], args.append)
+    return results
+
+
+def collect_batch(reports, args):
+    # Keeps the rows of every report in memory, sharing one copy of each gene, chromosome, sample and
+    # attribute string across the whole batch
+    results = []
+    rows = []
+    with interning():
+        for result, report_rows in run_in_order(extract_one, reports, args):
+            results.append(result)
+            rows.extend(interner.intern_row(cnv) for cnv in report_rows)
+
+    return results, rows
+
+
+def extract_xml(xml_bytes, args):
+    start_report(args)
+    if args.prescan and not contains_copy_numbers(xml_bytes):
+        metrics.increment('prescan_skipped')
+        return [], finish_report({})
+
+    try:
+        metrics.increment('bytes_read', len(xml_bytes))
+        with metrics.timer('read_xml'):
+            xml_dict = parse_xml(xml_bytes, args.stream, args.parser)
+        rows = list(metrics.timed('extract_copy_numbers', iter_copy_numbers(
+            xml_dict['rr:ResultsReport']['rr:ResultsPayload'], load_mappings(args.mapping_file), all_samples(args),
+            validation_mode(args)), 'alterations'))
+    finally:
+        counts = finish_report({})
+
+    return rows, counts
+
+
+def read_report(xml_file, data=None):
+    with preloaded(xml_file, data):
+        return read_input(xml_file)
+
+
+async def convert_async(report, args, semaphore, executor, journal=None, data=None):
+    # The caller has acquired the semaphore for this report; it is released once the report is written
+    xml_file, out_file = report
+    loop = asyncio.get_running_loop()
+    result = {'xml_file': xml_file, 'out_file': out_file, 'status': 'success', 'error': '', 'unresolved': {},
+              'invalid': [], 'metrics': {'stages': {}, 'counters': {}}}
+    try:
+        try:
+            xml_bytes = await loop.run_in_executor(None, read_report, xml_file, data)
+            if data is not None and journal:
+                result['sha256'] = hashlib.sha256(xml_bytes).hexdigest()
+            del data
+            rows, counts = await loop.run_in_executor(executor, extract_xml, xml_bytes, args)
+            result.update(counts)
+            del xml_bytes
+            await loop.run_in_executor(None, write_copy_numbers_to_cnv, {'CopyNumbers': rows},
+                                       argparse.Namespace(**dict(vars(args), out_file=out_file)))
+        except Exception as ex:
+            logger.error('Failed to convert %s: %s', xml_file, ex)
+            result.update(status='failure', error=repr(ex))
+    finally:
+        semaphore.release()
+
+    if journal:
+        journal.record(result)
+    return result
+
+
+async def convert_many_async(reports, args, concurrency=16, journal=None):
+    # Reads are prefetched concurrently (bounded by the semaphore) on the default thread pool while
+    # parsing runs on --jobs worker processes, so slow storage and CPU-bound parsing overlap. Parsing
+    # always runs in worker processes, even for --jobs 1: each worker extracts one report at a time, so
+    # the unresolved values, validation errors and metrics it hands back belong to that report alone.
+    # Archive members are read in one pass, at most `concurrency` reports ahead of the conversions.
+    semaphore = asyncio.Semaphore(concurrency)
+    executor = ProcessPoolExecutor(max_workers=max(getattr(args, 'jobs', 1), 1))
+    loop = asyncio.get_running_loop()
+    contents = iter_contents(reports)
+    conversions = []
+    try:
+        while True:
+            await semaphore.acquire()
+            item = await loop.run_in_executor(None, next, contents, None)
+            if item is None:
+                semaphore.release()
+                break
+            report, data = item
+            conversions.append(asyncio.ensure_future(convert_async(report, args, semaphore, executor, journal,
+                                                                   data)))
+        return await asyncio.gather(*conversions)
+    finally:
+        executor.shutdown()
+
+
+def write_summary(results, summary_file):
+    with open(summary_file, 'w') as csvfile:
+        csv_writer = csv.DictWriter(csvfile, fieldnames=SUMMARY_FIELDS, extrasaction='ignore')
+        csv_writer.writeheader()
+        csv_writer.writerows(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='foundation-xml-cnv-batch',
+        description='Extracts copy number information from many FoundationOne XML reports in a single process.')
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument('-i', '--input', dest='xml_input',
+                        help='Directory of XML files, a glob pattern matching XML files, or a zip or tar archive of '
+                             'XML files')
+    inputs.add_argument('-m', '--manifest', dest='manifest_file',
+                        help='CSV file of xml_file,out_file pairs')
+    parser.add_argument('-d', '--output-dir', dest='output_dir', default='.',
+                        help='Directory to write CNV files to when converting a directory or glob')
+    parser.add_argument('--merge', dest='merge_file',
+                        help='Write every report into this single output with a source_file column '
+                             '(gzip compressed when it ends in .gz)')
+    parser.add_argument('--append', dest='append', action='store_true',
+                        help='Append to the --merge output instead of replacing it, writing the header only once')
+    parser.add_argument('-s', '--summary', dest='summary_file',
+                        help='Path to write the per-report success/failure summary CSV')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        help='Number of worker processes to convert reports with')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Prefetch reports concurrently with asyncio, overlapping I/O with parsing')
+    parser.add_argument('--concurrency', dest='concurrency', type=int, default=16,
+                        help='Maximum number of reports read or converted at once with --async')
+    parser.add_argument('--stream', dest='stream', action='store_true',
+                        help='Stream the XML, keeping only the samples and copy number alterations in memory')
+    parser.add_argument('--parser', dest='parser', choices=sorted(XML_PARSERS), default='xmltodict',
+                        help='XML parser backend; expat only builds the elements used for extraction')
+    parser.add_argument('--prescan', dest='prescan', action='store_true',
+                        help='Scan each raw file for copy-number-alteration elements first and write an empty output '
+                             'without parsing when there are none')
+    parser.add_argument('--mappings', dest='mapping_file',
+                        help='JSON or YAML file overriding the status and interpretation mappings')
+    parser.add_argument('-f', '--format', dest='format', choices=sorted(OUTPUT_WRITERS), default='csv',
+                        help='Output format of the CNV files')
+    parser.add_argument('--samples', dest='samples', choices=SAMPLE_MODES, default='first-dna',
+                        help='first-dna labels each alteration with its DNA evidence sample (or the first DNA '
+                             'sample); all writes a row per DNA and RNA evidence sample with a nucleic_acid_type '
+                             'column')
+    parser.add_argument('--split-samples', dest='split_samples', action='store_true',
+                        help='Write each sample of a report to its own file, named like report.SA-1.csv (not used '
+                             'with --merge, --journal or --index)')
+    parser.add_argument('--sections', dest='sections', nargs='+', choices=list(SECTIONS), default=['copy-numbers'],
+                        help='Variant-report sections to extract from a single parse of each report; other sections '
+                             'are written beside the copy number output, named like report.short-variants.csv (not '
+                             'used with --merge or --async)')
+    parser.add_argument('--validate', dest='validate', choices=VALIDATION_MODES, default='strict',
+                        help='strict fails a report on the first alteration missing a required attribute or with a '
+                             'malformed position or copy number; lenient skips such alterations and carries on')
+    parser.add_argument('--validation-errors', dest='errors_file',
+                        help='Write the alterations skipped by --validate lenient to this NDJSON file, one error per '
+                             'attribute with its report, gene and (with --parser expat) line number')
+    parser.add_argument('--journal', dest='journal_file',
+                        help='SQLite journal of converted reports; a rerun only converts new, changed or failed '
+                             'reports (not used with --merge)')
+    parser.add_argument('--index', dest='index_file',
+                        help='Build a genomic interval index over the converted outputs (or the --merge output) for '
+                             'src.index queries')
+    parser.add_argument('--cache-dir', dest='cache_dir',
+                        help='Directory caching extracted rows by report content, shared by all workers '
+                             '(not used with --async)')
+    parser.add_argument('--cache-max-mb', dest='cache_max_mb', type=int, default=1024,
+                        help='Size the cache is trimmed to, least recently used entries first')
+    parser.add_argument('--metrics', dest='metrics_file',
+                        help='Write stage timings and counters to this JSON file, or Prometheus textfile if it ends '
+                             'in .prom')
+    parser.add_argument('--profile', dest='profile_file',
+                        help='Write a cProfile dump of the batch (parent process only) to this file')
+    args = parser.parse_args()
+    configure_logging()
+    if args.append and args.format in BINARY_FORMATS:
+        parser.error('The %s format cannot be appended to; use --append with csv or ndjson' % args.format)
+    if args.split_samples and (args.merge_file or args.journal_file or args.index_file):
+        parser.error('--split-samples cannot be combined with --merge, --journal or --index')
+    if args.sections != ['copy-numbers']:
+        if args.merge_file or args.use_async:
+            parser.error('--sections cannot be combined with --merge or --async')
+        if args.format == 'table':
+            parser.error('The table format only holds copy numbers; use --sections copy-numbers')
+        if args.index_file and 'copy-numbers' not in args.sections:
+            parser.error('--index needs copy-numbers in --sections')
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info('Converting batch of XML reports with args: %s', json.dumps(args.__dict__))
+    if args.manifest_file:
+        reports = read_manifest(args.manifest_file)
+    elif args.merge_file:
+        reports = find_reports(args.xml_input, '')
+    else:
+        os.makedirs(args.output_dir, exist_ok=True)
+        reports = find_reports(args.xml_input, args.output_dir, '.' + args.format)
+
+    collisions = [] if args.merge_file else shared_outputs(reports)
+    if collisions:
+        parser.error('Several reports would be written to %s; name distinct outputs for them in a --manifest'
+                     % ', '.join(collisions))
+
+    journal = Journal(args.journal_file) if args.journal_file and not args.merge_file else None
+    all_reports = reports
+    skipped = []
+    if journal:
+        reports = journal.pending(all_reports)
+        pending = set(reports)
+        skipped = [skipped_result(report) for report in all_reports if report not in pending]
+        logger.info('Skipping %d reports already converted according to %s', len(skipped), args.journal_file)
+
+    start_report(args)
+    with profiled(args.profile_file):
+        if args.merge_file:
+            results = merge_batch(reports, args)
+        elif args.use_async:
+            results = asyncio.run(convert_many_async(reports, args, args.concurrency, journal))
+        else:
+            results = convert_batch(reports, args, journal)
+    if journal:
+        journal.close()
+    if skipped:
+        order = {report: i for i, report in enumerate(all_reports)}
+        results = sorted(skipped + results, key=lambda result: order[(result['xml_file'], result['out_file'])])
+
+    unresolved = Counter()
+    invalid = []
+    for result in results:
+        unresolved.update(result['unresolved'])
+        invalid.extend(dict(error, xml_file=result['xml_file']) for error in result['invalid'])
+        metrics.merge(result['metrics'])
+    report_unresolved_values(unresolved)
+    report_validation_errors(invalid, args.errors_file)
+
+    failures = [result for result in results if result['status'] == 'failure']
+    for failure in failures:
+        logger.error('Failed: %s (%s)', failure['xml_file'], failure['error'])
+    logger.info('Converted %d of %d reports (%d skipped)', len(results) - len(failures) - len(skipped), len(results),
+                len(skipped))
+    if args.summary_file:
+        write_summary(results, args.summary_file)
+
+    if args.index_file:
+        cnv_files = [args.merge_file] if args.merge_file else [result['out_file'] for result in results
+                                                               if result['status'] != 'failure']
+        with metrics.timer('build_index'):
+            build_index(cnv_files).save(args.index_file)
+    if args.cache_dir:
+        ResultCache(args.cache_dir, args.cache_max_mb * 1024 * 1024).evict()
+    if args.metrics_file:
+        metrics.increment('reports_converted', len(results) - len(failures) - len(skipped))
+        metrics.increment('reports_skipped', len(skipped))
+        metrics.increment('reports_failed', len(failures))
+        metrics.write(args.metrics_file)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import fcntl
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from src.inputs import open_input
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a change to the extraction alters the rows produced for the same report
+CONVERTER_VERSION = '1'
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def report_key(xml_file, mappings, sample_mode='first-dna', validation='strict'):
+    digest = hashlib.sha256()
+    digest.update(CONVERTER_VERSION.encode('utf-8'))
+    digest.update(repr([sorted(mapping.items()) for mapping in mappings]).encode('utf-8'))
+    if sample_mode != 'first-dna':
+        digest.update(sample_mode.encode('utf-8'))
+    if validation != 'strict':
+        # Lenient entries leave out invalid alterations that a strict run must fail on
+        digest.update(('validation:%s' % validation).encode('utf-8'))
+    return hash_file(xml_file, digest)
+
+
+def hash_file(xml_file, digest=None):
+    digest = digest or hashlib.sha256()
+    # Compressed reports and archive members hash their decompressed content
+    with open_input(xml_file) as fd:
+        for chunk in iter(lambda: fd.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json.gz')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with gzip.open(path, 'rt') as fd:
+                entry = json.load(fd)
+            # Reads refresh the mtime, which is what eviction orders entries by
+            os.utime(path)
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, entry):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Entries are written to a temporary file and renamed so concurrent readers never see partial data
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw_file, gzip.open(raw_file, 'wt') as tmp_file:
+                json.dump(entry, tmp_file, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def evict(self):
+        if not os.path.isdir(self.cache_dir):
+            return 0
+
+        with open(os.path.join(self.cache_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            entries = []
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if name.endswith('.json.gz'):
+                        try:
+                            stat = os.stat(os.path.join(root, name))
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+
+            total = sum(size for _, size, _ in entries)
+            evicted = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+
+        if evicted:
+            logger.info('Evicted %d entries from the result cache', evicted)
+        return evicted
@@ -1,65 +1,304 @@
 #!/usr/bin/env python
 import argparse
 import csv
-import json, ast
+import fcntl
+import json
 import logging
+import mmap
+import os
+import re
+import sys
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from types import MappingProxyType
+from xml.parsers import expat
 
-import xmltodict
+if __name__ == '__main__':
+    # python src/convert.py and python -m src.convert hand over to the package entry point, which imports this
+    # module once as src.convert, so src.sections and the workers share its state
+    if not __package__:
+        sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.argv.insert(1, 'convert')
+    from src.__main__ import main as run
+    sys.exit(run())
+
+from src import configure_logging
+from src.inputs import open_input, split_member
+from src.interning import interner, passthrough
+from src.metrics import metrics, profiled
+from src.validation import (POSITION_PATTERN, VALIDATION_MODES, invalid_copy_number, pop_validation_errors,
+                            report_validation_errors, validation_errors)
 
-logging.basicConfig(level=logging.INFO,
-                    format='[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s')
 logger = logging.getLogger(__name__)
 
 
-def read_xml(xml_file):
-    with open(xml_file) as fd:
-        return xmltodict.parse(fd.read())
+STREAMED_SECTIONS = ('samples', 'copy-number-alterations')
+
+# --sections names and the variant-report elements they are extracted from
+SECTIONS = OrderedDict([
+    ('copy-numbers', 'copy-number-alterations'),
+    ('short-variants', 'short-variants'),
+    ('rearrangements', 'rearrangements'),
+    ('biomarkers', 'biomarkers'),
+])
+
 
+COPY_NUMBER_ELEMENT_PATTERN = re.compile(rb'<(?:[\w.-]+:)?copy-number-alteration[\s/>]')
 
-def calculate_status(equivocal, copy_type):
-    if copy_type == 'amplification':
-        if equivocal == 'true':
-            return 'gain'
-        return 'amplification'
-    if copy_type == 'loss':
-        if equivocal == 'true':
-            return 'partial_loss'
-        return 'loss'
-    if copy_type == 'partial amplification':
-        return 'gain'
+UTF16_BOMS = (b'\xff\xfe', b'\xfe\xff')
 
-    logger.error('Failed to resolve copy type: %s, equivocal: %s', copy_type, equivocal)
-    return ''
+PRESCAN_CHUNK_SIZE = 1024 * 1024
 
+PRESCAN_OVERLAP = 256
 
-def calculate_interpretation(status):
-    if status == 'known':
-        return 'Pathogenic'
-    if status == 'likely':
-        return 'Likely pathogenic'
-    if status == 'unknown':
-        return 'Uncertain significance'
-    if status == 'ambiguous':
-        return 'other'
 
-    logger.error('Failed to resolve interpretation: %s', status)
-    return ''
+def contains_copy_numbers(xml_bytes):
+    # The byte scan only applies to ASCII-compatible encodings; anything else is assumed to need a parse
+    if xml_bytes[:2] in UTF16_BOMS or xml_bytes[:2] in (b'<\x00', b'\x00<'):
+        return True
+    return COPY_NUMBER_ELEMENT_PATTERN.search(xml_bytes) is not None
+
+
+def report_has_copy_numbers(xml_file):
+    with open_input(xml_file) as fd:
+        if isinstance(fd, mmap.mmap):
+            return contains_copy_numbers(fd)
+
+        head = fd.read(PRESCAN_CHUNK_SIZE)
+        if not head or contains_copy_numbers(head):
+            return True
+        # Decompressed input is scanned in overlapping chunks so an element split between reads is still found
+        tail = head[-PRESCAN_OVERLAP:]
+        for chunk in iter(lambda: fd.read(PRESCAN_CHUNK_SIZE), b''):
+            window = tail + chunk
+            if COPY_NUMBER_ELEMENT_PATTERN.search(window):
+                return True
+            tail = window[-PRESCAN_OVERLAP:]
+        return False
+
+
+def read_xml(xml_file, stream=False, parser='xmltodict', sections=STREAMED_SECTIONS):
+    # Plain files are parsed straight from a memory map; compressed files and archive members are
+    # decompressed into the parser as it reads
+    with open_input(xml_file) as fd:
+        return parse_xml(fd, stream, parser, sections)
+
+
+def parse_xml(xml_input, stream=False, parser='xmltodict', sections=STREAMED_SECTIONS):
+    # sections names the variant-report elements the streaming and expat parsers keep
+    if stream and parser == 'xmltodict':
+        return parse_xml_streaming(xml_input, sections)
+
+    return XML_PARSERS[parser](xml_input, sections)
+
+
+def parse_xml_xmltodict(xml_input, sections=None):
+    # xmltodict pulls in urllib.request through xml.sax.saxutils, which dominates startup, so it is
+    # only imported once a report is actually parsed with it
+    import xmltodict
+    return xmltodict.parse(xml_input)
+
+
+def parse_xml_streaming(xml_input, sections=STREAMED_SECTIONS):
+    # Only the variant-report sections used for extraction are kept, with their text as xmltodict gives it.
+    # xmltodict's item_depth mode still buffers the text of the elements above the items, the base64 PDF
+    # included, so the document is streamed through the expat handler instead.
+    return parse_xml_expat(xml_input, sections, keep_text=True)
+
+
+class Element(OrderedDict):
+    # An attribute dict that remembers the line its element started on, for validation errors
+    line = None
+
+
+def parse_xml_expat(xml_input, sections=STREAMED_SECTIONS, keep_text=False):
+    # Builds xmltodict-shaped attribute dicts for the elements under the streamed sections only.
+    # Character data outside them is never collected, so text such as the base64 PDF costs nothing to skip;
+    # keep_text adds the stripped text of the streamed elements under '#text', as xmltodict does.
+    collected = {}
+    path = []
+    elements = []
+    texts = []
+
+    def is_streamed():
+        return len(path) >= 5 and path[2] == 'variant-report' and path[3] in sections
+
+    def start_element(name, attrs):
+        path.append(name)
+        if is_streamed():
+            element = Element(('@' + key, value) for key, value in attrs.items())
+            element.line = parser.CurrentLineNumber
+            elements.append(element)
+            texts.append([])
+
+    def character_data(data):
+        if texts:
+            texts[-1].append(data)
+
+    def end_element(name):
+        if is_streamed():
+            element = elements.pop()
+            text = ''.join(texts.pop()).strip() if keep_text else None
+            if elements:
+                if text and not element:
+                    # A child with only text is its text, as in xmltodict
+                    element = text
+                elif text:
+                    element['#text'] = text
+                element = element or None
+                parent = elements[-1]
+                if name not in parent:
+                    parent[name] = element
+                elif isinstance(parent[name], list):
+                    parent[name].append(element)
+                else:
+                    parent[name] = [parent[name], element]
+            else:
+                if text:
+                    element['#text'] = text
+                collected.setdefault(path[3], {}).setdefault(name, []).append(element or None)
+        path.pop()
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    if keep_text:
+        parser.CharacterDataHandler = character_data
+    # Match xmltodict's handling of entity declarations and external entities
+    parser.DefaultHandler = lambda data: None
+    parser.ExternalEntityRefHandler = lambda *args: 1
+    if hasattr(xml_input, 'read'):
+        parser.ParseFile(xml_input)
+    else:
+        parser.Parse(xml_input, True)
+
+    return build_report(collected)
+
+
+def build_report(sections):
+    variant_report = {}
+    for section, children in sections.items():
+        variant_report[section] = {name: elements if len(elements) > 1 else elements[0]
+                                   for name, elements in children.items()}
+
+    return {'rr:ResultsReport': {'rr:ResultsPayload': {'variant-report': variant_report}}}
+
+
+XML_PARSERS = {
+    'xmltodict': parse_xml_xmltodict,
+    'expat': parse_xml_expat,
+}
+
+
+STATUS_MAP = {
+    ('amplification', True): 'gain',
+    ('amplification', False): 'amplification',
+    ('loss', True): 'partial_loss',
+    ('loss', False): 'loss',
+    ('partial amplification', True): 'gain',
+    ('partial amplification', False): 'gain',
+}
+
+INTERPRETATION_MAP = {
+    'known': 'Pathogenic',
+    'likely': 'Likely pathogenic',
+    'unknown': 'Uncertain significance',
+    'ambiguous': 'other',
+}
+
+# Values missing from the lookup tables, counted here and reported once per run
+unresolved_values = Counter()
+
+
+@lru_cache(maxsize=None)
+def load_mappings(mapping_file=None):
+    status_map = dict(STATUS_MAP)
+    interpretation_map = dict(INTERPRETATION_MAP)
+    # The maps are cached and shared by every caller, so they are handed out read-only
+    if not mapping_file:
+        return MappingProxyType(status_map), MappingProxyType(interpretation_map)
+
+    with open(mapping_file) as fd:
+        if mapping_file.endswith(('.yml', '.yaml')):
+            import yaml
+            mappings = yaml.safe_load(fd)
+        else:
+            mappings = json.load(fd)
+
+    for copy_type, statuses in mappings.get('status', {}).items():
+        for equivocal, status in statuses.items():
+            status_map[(copy_type, str(equivocal).lower() == 'true')] = status
+    interpretation_map.update(mappings.get('interpretation', {}))
+
+    return MappingProxyType(status_map), MappingProxyType(interpretation_map)
+
+
+def calculate_status(equivocal, copy_type, status_map=None):
+    if status_map is None:
+        status_map = STATUS_MAP
+    status = status_map.get((copy_type, equivocal == 'true'))
+    if status is None:
+        unresolved_values['copy type: %s, equivocal: %s' % (copy_type, equivocal)] += 1
+        return ''
+    return status
+
+
+def calculate_interpretation(status, interpretation_map=None):
+    if interpretation_map is None:
+        interpretation_map = INTERPRETATION_MAP
+    interpretation = interpretation_map.get(status)
+    if interpretation is None:
+        unresolved_values['interpretation: %s' % status] += 1
+        return ''
+    return interpretation
+
+
+def pop_unresolved_values():
+    counts = dict(unresolved_values)
+    unresolved_values.clear()
+    for value, count in counts.items():
+        metrics.increment('unknown_interpretations' if value.startswith('interpretation:') else 'unknown_statuses',
+                          count)
+    return counts
+
+
+def report_unresolved_values(counts):
+    for value, count in sorted(counts.items()):
+        logger.error('Failed to resolve %s (%d alterations)', value, count)
 
 
-def gather_attributes(copy_number):
+def gather_attributes(copy_number, intern=passthrough):
     attributes = {}
     if '@number-of-exons' in copy_number.keys():
-        attributes['number-of-exons'] = copy_number['@number-of-exons']
+        attributes['number-of-exons'] = intern(copy_number['@number-of-exons'])
     if '@type' in copy_number.keys():
-        attributes['status'] = copy_number['@type']
+        attributes['status'] = intern(copy_number['@type'])
     if '@ratio' in copy_number.keys():
         attributes['ratio'] = copy_number['@ratio']
     if '@status' in copy_number.keys():
-        attributes['interpretation'] = copy_number['@status']
+        attributes['interpretation'] = intern(copy_number['@status'])
 
     return attributes
 
 
+@lru_cache(maxsize=65536)
+def split_position(position):
+    match = POSITION_PATTERN.match(position)
+    return match.groups() if match else None
+
+
+def parse_position(position, gene=None, as_int=False):
+    parts = split_position(position) if isinstance(position, str) else None
+    if parts is None:
+        raise ValueError('Invalid position %r for gene %s, expected chromosome:start-end' % (position, gene))
+
+    chromosome, start_position, end_position = parts
+    if as_int:
+        return chromosome, int(start_position), int(end_position)
+    return parts
+
+
 def extract_sample(samples):
     if not samples:
         return None
@@ -75,45 +314,312 @@ def extract_sample(samples):
     return sample.get('@name', None)
 
 
-def extract_copy_numbers(results_payload_dict):
+def build_sample_index(variant_report):
+    sample = (variant_report.get('samples') or {}).get('sample') or []
+    samples = sample if isinstance(sample, list) else [sample]
+    return OrderedDict(((s.get('@name'), s.get('@nucleic-acid-type')), s) for s in samples)
+
+
+EVIDENCE_TYPES = [('dna-evidence', 'DNA'), ('rna-evidence', 'RNA')]
+
+
+def iter_evidence(copy_number):
+    for tag, nucleic_acid_type in EVIDENCE_TYPES:
+        evidence = copy_number.get(tag)
+        for element in evidence if isinstance(evidence, list) else [evidence]:
+            if element and element.get('@sample'):
+                yield element['@sample'], nucleic_acid_type
+
+
+def iter_copy_numbers(results_payload_dict, mappings=None, every_sample=False, validation='strict'):
     logger.info('Extracting copy numbers from xml')
-    copy_number_list = {'CopyNumbers': []}
+    status_map, interpretation_map = mappings or (STATUS_MAP, INTERPRETATION_MAP)
 
     if 'copy-number-alterations' in results_payload_dict['variant-report'].keys():
         if (results_payload_dict['variant-report']['copy-number-alterations'] is not None and
                 'copy-number-alteration' in results_payload_dict['variant-report']['copy-number-alterations'].keys()):
 
-            sample_id = extract_sample(results_payload_dict['variant-report'])
+            intern = interner.intern if interner.enabled else passthrough
+            if interner.enabled:
+                sample_id = interner.resolve_sample(results_payload_dict['variant-report'], extract_sample)
+            else:
+                sample_id = extract_sample(results_payload_dict['variant-report'])
+            metrics.increment('samples_resolved' if sample_id is not None else 'samples_unresolved')
+            sample_index = build_sample_index(results_payload_dict['variant-report']) if every_sample else None
             variants_dict = results_payload_dict['variant-report']['copy-number-alterations']['copy-number-alteration']
             copy_numbers = variants_dict if isinstance(variants_dict, list) else [variants_dict]
 
-            for copy_number in copy_numbers:
-                copy_number_value = {'sample_id': copy_number.get('dna-evidence', {}).get('@sample', sample_id),
-                                     'gene': copy_number['@gene'],
-                                     'copy_number': float(format(copy_number['@copy-number'])),
-                                     'status': calculate_status(copy_number['@equivocal'], copy_number['@type']),
-                                     'chromosome': copy_number['@position'].split(":")[0],
-                                     'start_position': copy_number['@position'].split(":")[1].split("-")[0],
-                                     'end_position': copy_number['@position'].split(":")[1].split("-")[1],
-                                     'attributes': gather_attributes(copy_number),
-                                     'interpretation': calculate_interpretation(copy_number['@status'])}
+            for index, copy_number in enumerate(copy_numbers):
+                try:
+                    chromosome, start_position, end_position = parse_position(copy_number['@position'],
+                                                                              copy_number['@gene'])
+                    evidence = list(iter_evidence(copy_number))
+                    dna_samples = [name for name, nucleic_acid_type in evidence if nucleic_acid_type == 'DNA']
+                    cnv = {'sample_id': intern(dna_samples[0] if dna_samples else sample_id),
+                           'gene': intern(copy_number['@gene']),
+                           'copy_number': float(format(copy_number['@copy-number'])),
+                           'status': calculate_status(copy_number['@equivocal'], copy_number['@type'], status_map),
+                           'chromosome': intern(chromosome),
+                           'start_position': start_position,
+                           'end_position': end_position,
+                           'attributes': gather_attributes(copy_number, intern),
+                           'interpretation': calculate_interpretation(copy_number['@status'], interpretation_map)}
+                except (KeyError, TypeError, ValueError):
+                    # Extraction parses every validated attribute anyway, so elements are only checked against
+                    # the rules once it fails; strict raises with the details, lenient skips the alteration
+                    if not validation or not invalid_copy_number(copy_number, index, validation):
+                        raise
+                    continue
+                if not every_sample:
+                    yield cnv
+                    continue
+
+                # One row per evidence sample, each checked against the samples block of the report
+                for i, (evidence_sample, nucleic_acid_type) in enumerate(evidence or [(sample_id, 'DNA')]):
+                    if (evidence_sample, nucleic_acid_type) not in sample_index:
+                        metrics.increment('evidence_samples_unindexed')
+                    yield dict(cnv, sample_id=intern(evidence_sample), nucleic_acid_type=nucleic_acid_type,
+                               attributes=cnv['attributes'] if i == 0 else dict(cnv['attributes']))
+
+
+def extract_copy_numbers(results_payload_dict, mappings=None, every_sample=False, validation='strict'):
+    return {'CopyNumbers': list(iter_copy_numbers(results_payload_dict, mappings, every_sample, validation))}
+
+
+CNV_FIELDS = ['sample_id', 'gene', 'copy_number', 'status', 'attributes',
+              'chromosome', 'start_position', 'end_position', 'interpretation']
+
+ATTRIBUTE_FIELDS = ['number-of-exons', 'status', 'ratio', 'interpretation']
+
+# Merged outputs carry the report each row was extracted from
+MERGED_CNV_FIELDS = CNV_FIELDS + ['source_file']
+
+# With --samples all every evidence sample gets its own row, labelled with its nucleic acid type
+SAMPLE_CNV_FIELDS = CNV_FIELDS + ['nucleic_acid_type']
+
+SAMPLE_MODES = ['first-dna', 'all']
+
+PARQUET_ROW_GROUP_SIZE = 10000
+
+
+@contextmanager
+def open_output(out_file, mode='w'):
+    if out_file == '-':
+        yield sys.stdout.buffer if 'b' in mode else sys.stdout
+        return
+    if hasattr(out_file, 'write'):
+        yield out_file
+        return
+
+    if 'a' in mode:
+        with open_file(out_file, mode, out_file.endswith('.gz')) as fd:
+            # Serialise appends from concurrent runs so their rows are not interleaved
+            fcntl.flock(fd.fileno(), fcntl.LOCK_EX)
+            yield fd
+        return
+
+    # New outputs are written beside the target and renamed into place once complete, so
+    # readers never see a partial file
+    tmp_file = '%s.%s.tmp' % (out_file, os.urandom(16).hex())
+    try:
+        with open_file(tmp_file, mode, out_file.endswith('.gz')) as fd:
+            yield fd
+        os.replace(tmp_file, out_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.unlink(tmp_file)
+        raise
+
+
+def open_file(path, mode, compressed):
+    if compressed:
+        import gzip
+        return gzip.open(path, mode if 'b' in mode else mode + 't')
+    return open(path, mode)
+
+
+def needs_header(out_file, fd, append):
+    if not append or not isinstance(out_file, str) or out_file == '-':
+        return True
+    # Checked on the open file once open_output holds the lock, so concurrent appends to a new file
+    # cannot both decide to write the header; gzip files report the size of the compressed file
+    return os.fstat(fd.fileno()).st_size == 0
+
+
+def write_csv(copy_numbers, out_file, fields=None, append=False):
+    fields = CNV_FIELDS if fields is None else fields
+    with open_output(out_file, 'a' if append else 'w') as csvfile:
+        csv_writer = csv.writer(csvfile, delimiter=',')
+        if needs_header(out_file, csvfile, append):
+            csv_writer.writerow(fields)
+        for cnv in copy_numbers:
+            csv_writer.writerow([cnv[field] for field in fields])
 
-                copy_number_list['CopyNumbers'].append(ast.literal_eval(json.dumps(copy_number_value)))
 
-    return copy_number_list
+def typed_record(cnv):
+    record = dict(cnv)
+    for field in ('start_position', 'end_position'):
+        if field in cnv:
+            record[field] = int(cnv[field])
+    return record
 
 
-def write_copy_numbers_to_cnv(cnv_dict, args):
-    logger.info('Saving copy numbers to cnv file')
+def write_ndjson(copy_numbers, out_file, fields=None, append=False):
+    fields = CNV_FIELDS if fields is None else fields
+    with open_output(out_file, 'a' if append else 'w') as fd:
+        for cnv in copy_numbers:
+            record = typed_record(cnv)
+            fd.write(json.dumps({field: record[field] for field in fields}))
+            fd.write('\n')
 
-    with open(args.out_file, 'w') as csvfile:
-        csv_writer = csv.writer(csvfile, delimiter=',')
-        csv_writer.writerow(['sample_id', 'gene', 'copy_number', 'status', 'attributes',
-                             'chromosome', 'start_position', 'end_position', 'interpretation'])
+
+def write_parquet(copy_numbers, out_file, fields=None, append=False):
+    if append:
+        raise ValueError('Parquet files cannot be appended to')
+    fields = CNV_FIELDS if fields is None else fields
+
+    import pyarrow
+    import pyarrow.parquet
+
+    column_types = {
+        'copy_number': pyarrow.float64(),
+        'attributes': pyarrow.struct([(field, pyarrow.string()) for field in ATTRIBUTE_FIELDS]),
+        'start_position': pyarrow.int64(),
+        'end_position': pyarrow.int64(),
+    }
+    schema = pyarrow.schema([(field, column_types.get(field, pyarrow.string())) for field in fields])
+
+    def record_batches():
+        records = []
+        for cnv in copy_numbers:
+            record = typed_record(cnv)
+            if 'attributes' in fields:
+                record['attributes'] = {field: None if cnv['attributes'].get(field) is None
+                                        else str(cnv['attributes'][field]) for field in ATTRIBUTE_FIELDS}
+            records.append(record)
+            if len(records) == PARQUET_ROW_GROUP_SIZE:
+                yield records
+                records = []
+        yield records
+
+    with open_output(out_file, 'wb') as fd:
+        with pyarrow.parquet.ParquetWriter(fd, schema) as parquet_writer:
+            for records in record_batches():
+                parquet_writer.write_table(pyarrow.Table.from_pylist(records, schema=schema))
+
+
+def write_table(copy_numbers, out_file, fields=None, append=False):
+    if append:
+        raise ValueError('Copy number tables cannot be appended to')
+
+    from src.table import CopyNumberTable
+    with open_output(out_file, 'wb') as fd:
+        CopyNumberTable.from_dicts(copy_numbers).write(fd)
+
+
+OUTPUT_WRITERS = {
+    'csv': write_csv,
+    'ndjson': write_ndjson,
+    'parquet': write_parquet,
+    'table': write_table,
+}
+
+BINARY_FORMATS = {'parquet', 'table'}
+
+
+def all_samples(args):
+    return getattr(args, 'samples', 'first-dna') == 'all'
+
+
+def validation_mode(args):
+    return getattr(args, 'validate', 'strict')
+
+
+def cnv_fields(args):
+    return SAMPLE_CNV_FIELDS if all_samples(args) else CNV_FIELDS
+
+
+def sample_output(out_file, sample_id):
+    # report.csv.gz -> report.SA-1.csv.gz
+    compressed = '.gz' if out_file.endswith('.gz') else ''
+    base, extension = os.path.splitext(out_file[:len(out_file) - len(compressed)])
+    return '%s.%s%s%s' % (base, re.sub(r'[^\w.-]', '_', sample_id or 'no-sample'), extension, compressed)
+
+
+def write_copy_numbers_to_cnv(cnv_dict, args):
+    output_format = getattr(args, 'format', 'csv')
+    logger.info('Saving copy numbers to %s file', output_format)
+
+    with metrics.timer('write_copy_numbers_to_cnv'):
+        if not getattr(args, 'split_samples', False):
+            OUTPUT_WRITERS[output_format](cnv_dict['CopyNumbers'], args.out_file, cnv_fields(args))
+            return
+
+        if not isinstance(args.out_file, str) or args.out_file == '-':
+            raise ValueError('Per-sample outputs need an output path')
+        # A report's rows are grouped by sample in memory, then each sample is written to its own file
+        samples = OrderedDict()
         for cnv in cnv_dict['CopyNumbers']:
-            csv_writer.writerow([cnv['sample_id'], cnv['gene'], cnv['copy_number'],
-                                 cnv['status'], cnv['attributes'], cnv['chromosome'],
-                                 cnv['start_position'], cnv['end_position'], cnv['interpretation']])
+            samples.setdefault(cnv['sample_id'], []).append(cnv)
+        for sample_id, rows in samples.items():
+            OUTPUT_WRITERS[output_format](rows, sample_output(args.out_file, sample_id), cnv_fields(args))
+
+
+def read_copy_numbers(xml_file, args):
+    if args.prescan:
+        with metrics.timer('prescan'):
+            has_copy_numbers = report_has_copy_numbers(xml_file)
+        if not has_copy_numbers:
+            metrics.increment('prescan_skipped')
+            return iter(())
+
+    mappings = load_mappings(args.mapping_file)
+    if args.cache_dir:
+        from src.cache import ResultCache, report_key
+        cache = ResultCache(args.cache_dir)
+        key = report_key(xml_file, mappings, getattr(args, 'samples', 'first-dna'), validation_mode(args))
+        entry = cache.get(key)
+        if entry is not None:
+            metrics.increment('cache_hits')
+            unresolved_values.update(entry['unresolved'])
+            validation_errors.extend(entry.get('invalid', []))
+            return iter(entry['rows'])
+        metrics.increment('cache_misses')
+
+    with metrics.timer('read_xml'):
+        xml_dict = read_xml(xml_file, args.stream, args.parser)
+    if metrics.enabled and split_member(xml_file)[1] is None:
+        metrics.increment('bytes_read', os.path.getsize(xml_file))
+
+    copy_numbers = metrics.timed('extract_copy_numbers', iter_copy_numbers(
+        xml_dict['rr:ResultsReport']['rr:ResultsPayload'], mappings, all_samples(args), validation_mode(args)),
+        'alterations')
+    if args.cache_dir:
+        return cache_copy_numbers(copy_numbers, cache, key)
+    return copy_numbers
+
+
+def cache_copy_numbers(copy_numbers, cache, key):
+    # Rows are passed through as they are produced and cached once the report has been fully extracted
+    unresolved_before = Counter(unresolved_values)
+    invalid_before = len(validation_errors)
+    rows = []
+    for cnv in copy_numbers:
+        rows.append(cnv)
+        yield cnv
+
+    cache.put(key, {'rows': rows, 'unresolved': dict(unresolved_values - unresolved_before),
+                    'invalid': validation_errors[invalid_before:]})
+
+
+def convert_report(xml_file, args):
+    sections = list(OrderedDict.fromkeys(getattr(args, 'sections', None) or ['copy-numbers']))
+    if sections == ['copy-numbers']:
+        write_copy_numbers_to_cnv({'CopyNumbers': read_copy_numbers(xml_file, args)}, args)
+        return
+
+    from src.sections import convert_sections
+    convert_sections(xml_file, sections, args)
 
 
 def main():
@@ -121,19 +627,62 @@ def main():
         prog='foundation-xml-cnv',
         description='Extracts copy number information from FoundationOne XML reports into CSV resources.')
     parser.add_argument('-x, --xml', dest='xml_file',
-                        required=True, help='Path to the XML file')
+                        required=True,
+                        help='Path to the XML file, optionally .gz, .bz2 or .xz compressed, or a member of a zip or '
+                             'tar archive as archive.zip::report.xml')
     parser.add_argument('-o, --output', dest='out_file',
-                        required=True, help='Path to write the CNV file')
+                        required=True, help='Path to write the CNV file, or - for stdout')
+    parser.add_argument('--stream', dest='stream', action='store_true',
+                        help='Stream the XML, keeping only the samples and copy number alterations in memory')
+    parser.add_argument('--parser', dest='parser', choices=sorted(XML_PARSERS), default='xmltodict',
+                        help='XML parser backend; expat only builds the elements used for extraction')
+    parser.add_argument('--prescan', dest='prescan', action='store_true',
+                        help='Scan the raw file for copy-number-alteration elements first and write an empty output '
+                             'without parsing when there are none')
+    parser.add_argument('--mappings', dest='mapping_file',
+                        help='JSON or YAML file overriding the status and interpretation mappings')
+    parser.add_argument('-f', '--format', dest='format', choices=sorted(OUTPUT_WRITERS), default='csv',
+                        help='Output format of the CNV file')
+    parser.add_argument('--samples', dest='samples', choices=SAMPLE_MODES, default='first-dna',
+                        help='first-dna labels each alteration with its DNA evidence sample (or the first DNA '
+                             'sample); all writes a row per DNA and RNA evidence sample with a nucleic_acid_type '
+                             'column')
+    parser.add_argument('--split-samples', dest='split_samples', action='store_true',
+                        help='Write each sample to its own file, named like report.SA-1.csv')
+    parser.add_argument('--sections', dest='sections', nargs='+', choices=list(SECTIONS), default=['copy-numbers'],
+                        help='Variant-report sections to extract from a single parse of the report; copy numbers '
+                             'are written to the output path and other sections beside it, named like '
+                             'report.short-variants.csv (--prescan and --cache-dir only apply to copy numbers alone)')
+    parser.add_argument('--validate', dest='validate', choices=VALIDATION_MODES, default='strict',
+                        help='strict fails the report on the first alteration missing a required attribute or with a '
+                             'malformed position or copy number; lenient skips such alterations and carries on')
+    parser.add_argument('--validation-errors', dest='errors_file',
+                        help='Write the alterations skipped by --validate lenient to this NDJSON file, one error per '
+                             'attribute with its gene and (with --parser expat) line number')
+    parser.add_argument('--cache-dir', dest='cache_dir',
+                        help='Directory caching extracted rows by report content, skipping unchanged reports')
+    parser.add_argument('--cache-max-mb', dest='cache_max_mb', type=int, default=1024,
+                        help='Size the cache is trimmed to, least recently used entries first')
+    parser.add_argument('--metrics', dest='metrics_file',
+                        help='Write stage timings and counters to this JSON file, or Prometheus textfile if it ends '
+                             'in .prom')
+    parser.add_argument('--profile', dest='profile_file', help='Write a cProfile dump of the conversion to this file')
     args = parser.parse_args()
+    if args.format == 'table' and args.sections != ['copy-numbers']:
+        parser.error('The table format only holds copy numbers; use --sections copy-numbers')
+
+    configure_logging()
+    if logger.isEnabledFor(logging.INFO):
+        logger.info('Extracting copy numbers from XML and into CNV with args: %s', json.dumps(args.__dict__))
+    if args.metrics_file:
+        metrics.enable()
+    with profiled(args.profile_file):
+        convert_report(args.xml_file, args)
+    report_unresolved_values(pop_unresolved_values())
+    report_validation_errors(pop_validation_errors(), args.errors_file)
+    if args.cache_dir:
+        from src.cache import ResultCache
+        ResultCache(args.cache_dir, args.cache_max_mb * 1024 * 1024).evict()
+    if args.metrics_file:
+        metrics.write(args.metrics_file)
 
-    logger.info('Extracting copy numbers from XML and into CNV with args: %s', json.dumps(args.__dict__))
-    xml_dict = read_xml(args.xml_file)
-
-    cnv_dict = extract_copy_numbers(
-        xml_dict['rr:ResultsReport']['rr:ResultsPayload'])
-
-    write_copy_numbers_to_cnv(cnv_dict, args)
-
-
-if __name__ == '__main__':
-    main()
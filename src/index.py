@@ -0,0 +1,191 @@
+import argparse
+import bisect
+import csv
+import gzip
+import json
+import logging
+import os
+import sys
+from array import array
+
+from src import configure_logging
+from src.convert import MERGED_CNV_FIELDS, OUTPUT_WRITERS, parse_position
+from src.inputs import open_input
+from src.table import CopyNumberTable, positions
+
+logger = logging.getLogger(__name__)
+
+
+class IntervalIndex(object):
+    # Rows are kept in a CopyNumberTable sorted by chromosome and start. Within a chromosome, rows are binned by
+    # length into powers of two, each bin keeping its rows in start order. A row in a bin is no longer than the
+    # bin's limit, so only rows starting within that limit before the query can reach it, and every bin is
+    # searched by bisection. One whole-arm call only widens the search of its own bin.
+
+    def __init__(self, table):
+        self.table = table
+        self.ranges = {}
+        self.bins = {}
+
+        chromosomes = table.columns['chromosome']
+        for code, chromosome in enumerate(table.vocabularies['chromosome']):
+            count = chromosomes.count(code)
+            if count:
+                begin = chromosomes.index(code)
+                self.ranges[chromosome] = (begin, begin + count)
+
+        starts = table.columns['start_position']
+        ends = table.columns['end_position']
+        for chromosome, (begin, end) in self.ranges.items():
+            bins = {}
+            for row in range(begin, end):
+                rows, bin_starts = bins.setdefault(max(ends[row] - starts[row], 0).bit_length(),
+                                                   (array('q'), array('q')))
+                rows.append(row)
+                bin_starts.append(starts[row])
+            self.bins[chromosome] = [(2 ** length_bits, rows, bin_starts)
+                                     for length_bits, (rows, bin_starts) in sorted(bins.items())]
+
+    def __len__(self):
+        return len(self.table)
+
+    @classmethod
+    def build(cls, copy_numbers):
+        if not isinstance(copy_numbers, CopyNumberTable):
+            copy_numbers = CopyNumberTable.from_dicts(copy_numbers)
+        table = copy_numbers
+        chromosomes = table.columns['chromosome']
+        vocabulary = table.vocabularies['chromosome']
+        starts = table.columns['start_position']
+        order = sorted(range(len(table)), key=lambda row: (vocabulary[chromosomes[row]], starts[row]))
+        return cls(table.take(order))
+
+    def overlapping_rows(self, chromosome, start, end):
+        ends = self.table.columns['end_position']
+        found = []
+        for max_length, rows, starts in self.bins.get(chromosome, []):
+            first = bisect.bisect_left(starts, start - max_length)
+            last = bisect.bisect_right(starts, end, first)
+            found.extend(row for row in rows[first:last] if ends[row] >= start)
+        return sorted(found)
+
+    def overlapping(self, chromosome, start, end):
+        return self.table.take(self.overlapping_rows(chromosome, start, end))
+
+    def gene_rows(self, gene):
+        # Only the requested gene's code is searched for in the raw bytes of the code column
+        return positions(self.table.columns['gene'], self.table.codes('gene', gene))
+
+    def gene(self, gene):
+        return self.table.take(self.gene_rows(gene))
+
+    def write(self, fd):
+        self.table.write(fd)
+
+    @classmethod
+    def read(cls, fd):
+        return cls(CopyNumberTable.read(fd))
+
+    def save(self, index_file):
+        with open(index_file, 'wb') as fd:
+            self.write(fd)
+
+    @classmethod
+    def load(cls, index_file):
+        with open_input(index_file) as fd:
+            return cls.read(fd)
+
+
+def parse_region(region):
+    if ':' not in region:
+        return region, 0, sys.maxsize
+    return parse_position(region.replace(',', ''), as_int=True)
+
+
+def cnv_format(cnv_file):
+    name = cnv_file[:-len('.gz')] if cnv_file.endswith('.gz') else cnv_file
+    return os.path.splitext(name)[1].lstrip('.')
+
+
+def open_text(cnv_file):
+    if cnv_file.endswith('.gz'):
+        return gzip.open(cnv_file, 'rt', encoding='utf-8', newline='')
+    return open(cnv_file, encoding='utf-8', newline='')
+
+
+def read_cnv_file(cnv_file):
+    output_format = cnv_format(cnv_file)
+    if output_format == 'table':
+        rows = CopyNumberTable.load(cnv_file)
+    elif output_format == 'parquet':
+        import pyarrow.parquet
+        rows = pyarrow.parquet.read_table(cnv_file).to_pylist()
+        for cnv in rows:
+            cnv['attributes'] = {key: value for key, value in cnv['attributes'].items() if value is not None}
+    elif output_format == 'ndjson':
+        with open_text(cnv_file) as fd:
+            rows = [json.loads(line) for line in fd if line.strip()]
+    else:
+        # CSV attributes are the repr of a dict; ast is only needed here, not on the conversion path
+        import ast
+        with open_text(cnv_file) as fd:
+            rows = [dict(cnv, attributes=ast.literal_eval(cnv['attributes'])) for cnv in csv.DictReader(fd)]
+
+    for cnv in rows:
+        if not cnv.get('source_file'):
+            cnv['source_file'] = cnv_file
+        yield cnv
+
+
+def build_index(cnv_files):
+    table = CopyNumberTable()
+    for cnv_file in cnv_files:
+        logger.info('Indexing %s', cnv_file)
+        table.extend(read_cnv_file(cnv_file))
+    return IntervalIndex.build(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='foundation-xml-cnv-index',
+        description='Builds and queries a genomic interval index over converted CNV files.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help='Index converted CNV files (csv, ndjson, parquet or table)')
+    build_parser.add_argument('cnv_files', nargs='+', help='CNV files written by src.convert or src.batch')
+    build_parser.add_argument('-o', '--output', dest='index_file', required=True, help='Path to write the index to')
+
+    query_parser = commands.add_parser('query', help='Print the calls overlapping a region or in a gene')
+    query_parser.add_argument('index_file', help='Index written by the build command')
+    query_parser.add_argument('region', nargs='?', help='chromosome:start-end, or a chromosome')
+    query_parser.add_argument('-g', '--gene', dest='gene', help='Only calls in this gene')
+    query_parser.add_argument('--status', dest='status', nargs='+', help='Only calls with one of these statuses')
+    query_parser.add_argument('-f', '--format', dest='format', choices=sorted(OUTPUT_WRITERS), default='csv',
+                              help='Output format of the matching calls')
+    query_parser.add_argument('-o', '--output', dest='out_file', default='-',
+                              help='Path to write the matching calls to, or - for stdout')
+    args = parser.parse_args()
+    configure_logging()
+
+    if args.command == 'build':
+        index = build_index(args.cnv_files)
+        index.save(args.index_file)
+        logger.info('Indexed %d calls from %d files into %s', len(index), len(args.cnv_files), args.index_file)
+        return
+
+    if not args.region and not args.gene:
+        parser.error('query needs a region, --gene or both')
+    try:
+        region = parse_region(args.region) if args.region else None
+    except ValueError:
+        parser.error('invalid region %r, expected chromosome:start-end or a chromosome' % args.region)
+
+    index = IntervalIndex.load(args.index_file)
+    table = index.overlapping(*region) if region else index.gene(args.gene)
+    if args.gene or args.status:
+        table = table.select(gene=args.gene, status=args.status)
+    OUTPUT_WRITERS[args.format](table, args.out_file, MERGED_CNV_FIELDS)
+
+
+if __name__ == '__main__':
+    main()
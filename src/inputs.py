@@ -0,0 +1,148 @@
+import importlib
+import io
+import mmap
+import os
+from contextlib import contextmanager
+
+# Members of zip and tar archives are addressed as <archive>::<member>
+ARCHIVE_SEPARATOR = '::'
+
+# Compression and archive modules are imported on first use so plain reports never load them
+COMPRESSED_MODULES = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'lzma',
+}
+
+REPORT_EXTENSIONS = ['.xml'] + ['.xml' + extension for extension in COMPRESSED_MODULES]
+
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# Archive members already read into memory, by <archive>::<member>; see preloaded()
+preloaded_members = {}
+
+
+def split_member(xml_file):
+    archive, _, member = xml_file.partition(ARCHIVE_SEPARATOR)
+    return archive, member or None
+
+
+def is_archive(path):
+    return path.endswith('.zip') or path.endswith(TAR_EXTENSIONS)
+
+
+def is_report(name):
+    return name.endswith(tuple(REPORT_EXTENSIONS))
+
+
+def report_stem(xml_file):
+    name = os.path.basename(split_member(xml_file)[1] or xml_file)
+    for extension in sorted(REPORT_EXTENSIONS, key=len, reverse=True):
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return os.path.splitext(name)[0]
+
+
+def compressed_opener(name):
+    module = COMPRESSED_MODULES.get(os.path.splitext(name)[1])
+    return importlib.import_module(module).open if module else None
+
+
+def list_archive(archive):
+    if archive.endswith('.zip'):
+        import zipfile
+        with zipfile.ZipFile(archive) as zip_file:
+            members = [info.filename for info in zip_file.infolist() if not info.is_dir()]
+    else:
+        import tarfile
+        with tarfile.open(archive, 'r:*') as tar_file:
+            members = [info.name for info in tar_file if info.isfile()]
+
+    return [archive + ARCHIVE_SEPARATOR + member for member in members if is_report(member)]
+
+
+def iter_archive(archive):
+    # One sequential pass over the archive yielding (xml_file, member bytes) for every report member. A
+    # compressed tar can only be read from the start, so opening its members one by one is quadratic.
+    if archive.endswith('.zip'):
+        import zipfile
+        with zipfile.ZipFile(archive) as zip_file:
+            for info in zip_file.infolist():
+                if not info.is_dir() and is_report(info.filename):
+                    yield archive + ARCHIVE_SEPARATOR + info.filename, zip_file.read(info)
+    else:
+        import tarfile
+        with tarfile.open(archive, 'r|*') as tar_file:
+            for info in tar_file:
+                if info.isfile() and is_report(info.name):
+                    yield archive + ARCHIVE_SEPARATOR + info.name, tar_file.extractfile(info).read()
+
+
+@contextmanager
+def preloaded(xml_file, data):
+    # While active, open_input serves the archive member from data instead of reopening its archive
+    if data is None:
+        yield
+        return
+    preloaded_members[xml_file] = data
+    try:
+        yield
+    finally:
+        del preloaded_members[xml_file]
+
+
+def input_stat(xml_file):
+    # Members share the mtime and size of their archive; an unchanged archive means unchanged members
+    return os.stat(split_member(xml_file)[0])
+
+
+@contextmanager
+def open_input(xml_file):
+    archive, member = split_member(xml_file)
+    if member is not None:
+        with open_member(archive, member) as fd:
+            opener = compressed_opener(member)
+            if opener:
+                with opener(fd, 'rb') as member_fd:
+                    yield member_fd
+            else:
+                yield fd
+        return
+
+    opener = compressed_opener(xml_file)
+    if opener:
+        with opener(xml_file, 'rb') as fd:
+            yield fd
+        return
+
+    with open(xml_file, 'rb') as fd:
+        # Empty files cannot be mapped; the parser reports them as malformed
+        if os.fstat(fd.fileno()).st_size == 0:
+            yield fd
+            return
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+@contextmanager
+def open_member(archive, member):
+    data = preloaded_members.get(archive + ARCHIVE_SEPARATOR + member)
+    if data is not None:
+        yield io.BytesIO(data)
+    elif archive.endswith('.zip'):
+        import zipfile
+        with zipfile.ZipFile(archive) as zip_file, zip_file.open(member) as fd:
+            yield fd
+    else:
+        import tarfile
+        with tarfile.open(archive, 'r:*') as tar_file:
+            fd = tar_file.extractfile(member)
+            if fd is None:
+                raise ValueError('%s is not a file in %s' % (member, archive))
+            with fd:
+                yield fd
+
+
+def read_input(xml_file):
+    with open_input(xml_file) as fd:
+        return fd.read()
@@ -0,0 +1,71 @@
+from contextlib import contextmanager
+
+# Row fields and attributes whose values repeat across reports; positions and ratios are mostly unique
+INTERNED_FIELDS = ['sample_id', 'gene', 'status', 'chromosome', 'interpretation', 'source_file']
+
+INTERNED_ATTRIBUTES = ['number-of-exons', 'status', 'interpretation']
+
+
+# Opt-in, batch-scoped vocabulary of the strings repeated across reports (genes, chromosomes, sample names,
+# attribute values) plus the last sample resolution; everything is passed through untouched until enable()
+class Interner(object):
+
+    def __init__(self):
+        self.enabled = False
+        self.values = {}
+        self.last_samples = (None, None)
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self.values = {}
+        self.last_samples = (None, None)
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self, value):
+        return self.values.setdefault(value, value)
+
+    def intern_row(self, cnv):
+        # Rows pickled back from worker processes arrive with their own copies of every string
+        for field in INTERNED_FIELDS:
+            if field in cnv:
+                cnv[field] = self.intern(cnv[field])
+        attributes = cnv['attributes']
+        for attribute in INTERNED_ATTRIBUTES:
+            if attribute in attributes:
+                attributes[attribute] = self.intern(attributes[attribute])
+        return cnv
+
+    def resolve_sample(self, variant_report, resolve):
+        # Sections of one report share its samples block, so the name resolved for the last block is reused
+        # when the same block (by identity, so the check is O(1)) comes back; other reports resolve their own,
+        # and only the interned name is shared between them
+        samples = variant_report.get('samples') if variant_report else None
+        block, sample_id = self.last_samples
+        if samples is None or block is not samples:
+            sample_id = resolve(variant_report)
+            sample_id = None if sample_id is None else self.intern(sample_id)
+            self.last_samples = (samples, sample_id)
+        return sample_id
+
+interner = Interner()
+
+
+def passthrough(value):
+    return value
+
+
+@contextmanager
+def interning():
+    interner.enable()
+    try:
+        yield interner
+    finally:
+        interner.disable()
+        interner.clear()
@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import time
+
+from src.cache import hash_file
+from src.inputs import input_stat, iter_archive, preloaded, split_member
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS reports (
+    xml_file TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER,
+    sha256 TEXT,
+    out_file TEXT,
+    status TEXT,
+    error TEXT,
+    updated_at REAL
+)
+'''
+
+
+class Journal(object):
+
+    def __init__(self, journal_file):
+        self.connection = sqlite3.connect(journal_file)
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+        self.member_hashes = {}
+
+    def close(self):
+        self.connection.close()
+
+    def is_converted(self, xml_file, out_file):
+        row = self.connection.execute('SELECT mtime, size, sha256, out_file, status FROM reports WHERE xml_file = ?',
+                                      (xml_file,)).fetchone()
+        if row is None or row[3] != out_file or row[4] != 'success' or not os.path.exists(out_file):
+            return False
+
+        try:
+            stat = input_stat(xml_file)
+        except FileNotFoundError:
+            return False
+        if stat.st_size != row[1]:
+            return False
+        # Only reports whose mtime moved without a size change need hashing to tell if they changed
+        return stat.st_mtime == row[0] or self.input_hash(xml_file) == row[2]
+
+    def input_hash(self, xml_file):
+        archive, member = split_member(xml_file)
+        if member is None:
+            return hash_file(xml_file)
+        # A touched archive has all of its members hashed in one pass rather than reopened per member
+        if archive not in self.member_hashes:
+            self.member_hashes[archive] = {}
+            for member_file, data in iter_archive(archive):
+                with preloaded(member_file, data):
+                    self.member_hashes[archive][member_file] = hash_file(member_file)
+        return self.member_hashes[archive].get(xml_file)
+
+    def pending(self, reports):
+        self.member_hashes = {}
+        return [report for report in reports if not self.is_converted(*report)]
+
+    def record(self, result):
+        xml_file = result['xml_file']
+        try:
+            stat = input_stat(xml_file)
+            # Archive members arrive with the hash their worker took while the member was in memory. Failed
+            # reports are always converted again, so they are not hashed (a missing member cannot be)
+            sha256 = result.get('sha256') or (hash_file(xml_file) if result['status'] == 'success' else None)
+            mtime, size = stat.st_mtime, stat.st_size
+        except FileNotFoundError:
+            mtime, size, sha256 = None, None, None
+
+        self.connection.execute('INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                (xml_file, mtime, size, sha256, result['out_file'], result['status'],
+                                 result['error'], time.time()))
+        self.connection.commit()
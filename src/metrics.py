@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+PROMETHEUS_PREFIX = 'foundation_xml_cnv'
+
+
+# Opt-in stage timers and counters; everything is a no-op until enable() is called
+class Metrics(object):
+
+    def __init__(self):
+        self.enabled = False
+        self.seconds = Counter()
+        self.calls = Counter()
+        self.counters = Counter()
+        self._local = threading.local()
+
+    def enable(self):
+        self.enabled = True
+
+    @contextmanager
+    def timer(self, stage):
+        if not self.enabled:
+            yield
+            return
+
+        # Time spent in nested timers is attributed to the nested stage only
+        nested = self._local.__dict__.setdefault('nested', [])
+        nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.seconds[stage] += elapsed - nested.pop()
+            self.calls[stage] += 1
+            if nested:
+                nested[-1] += elapsed
+
+    def timed(self, stage, iterable, counter=None):
+        if not self.enabled:
+            return iterable
+        return self._timed(stage, iterable, counter)
+
+    def _timed(self, stage, iterable, counter):
+        iterator = iter(iterable)
+        while True:
+            with self.timer(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            if counter:
+                self.counters[counter] += 1
+            yield item
+
+    def increment(self, counter, value=1):
+        if self.enabled:
+            self.counters[counter] += value
+
+    def to_dict(self):
+        return {'stages': {stage: {'seconds': self.seconds[stage], 'calls': self.calls[stage]}
+                           for stage in sorted(self.calls)},
+                'counters': dict(sorted(self.counters.items()))}
+
+    def merge(self, summary):
+        for stage, timing in summary['stages'].items():
+            self.seconds[stage] += timing['seconds']
+            self.calls[stage] += timing['calls']
+        self.counters.update(summary['counters'])
+
+    def pop(self):
+        summary = self.to_dict()
+        self.seconds.clear()
+        self.calls.clear()
+        self.counters.clear()
+        return summary
+
+    def to_prometheus(self):
+        lines = ['# TYPE %s_stage_seconds_total counter' % PROMETHEUS_PREFIX]
+        for stage in sorted(self.calls):
+            lines.append('%s_stage_seconds_total{stage="%s"} %f' % (PROMETHEUS_PREFIX, stage, self.seconds[stage]))
+        lines.append('# TYPE %s_stage_calls_total counter' % PROMETHEUS_PREFIX)
+        for stage in sorted(self.calls):
+            lines.append('%s_stage_calls_total{stage="%s"} %d' % (PROMETHEUS_PREFIX, stage, self.calls[stage]))
+        for counter, value in sorted(self.counters.items()):
+            name = '%s_%s_total' % (PROMETHEUS_PREFIX, counter.replace('-', '_'))
+            lines.append('# TYPE %s counter' % name)
+            lines.append('%s %d' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, metrics_file):
+        with open(metrics_file, 'w') as fd:
+            if metrics_file.endswith('.prom'):
+                fd.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), fd, indent=2)
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def profiled(profile_file):
+    if not profile_file:
+        yield
+        return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
@@ -0,0 +1,164 @@
+import logging
+import os
+from collections import OrderedDict
+
+from src.convert import (INTERPRETATION_MAP, OUTPUT_WRITERS, SECTIONS, STATUS_MAP, all_samples,
+                         calculate_interpretation, extract_sample, iter_copy_numbers, iter_evidence, load_mappings,
+                         read_xml, validation_mode, write_copy_numbers_to_cnv)
+from src.interning import interner, passthrough
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SHORT_VARIANT_FIELDS = ['sample_id', 'gene', 'chromosome', 'position', 'cds_effect', 'protein_effect',
+                        'functional_effect', 'transcript', 'allele_fraction', 'depth', 'status', 'interpretation']
+
+REARRANGEMENT_FIELDS = ['sample_id', 'targeted_gene', 'other_gene', 'type', 'pos1', 'pos2', 'in_frame',
+                        'allele_fraction', 'supporting_read_pairs', 'status', 'interpretation']
+
+BIOMARKER_FIELDS = ['sample_id', 'biomarker', 'status', 'score', 'unit']
+
+SECTION_FORMATS = ['csv', 'ndjson', 'parquet']
+
+SECTION_FIELDS = {
+    'short-variants': SHORT_VARIANT_FIELDS,
+    'rearrangements': REARRANGEMENT_FIELDS,
+    'biomarkers': BIOMARKER_FIELDS,
+}
+
+
+def xml_sections(sections):
+    return ('samples',) + tuple(SECTIONS[section] for section in sections)
+
+
+def section_elements(variant_report, section, element):
+    elements = (variant_report.get(section) or {}).get(element) or []
+    return elements if isinstance(elements, list) else [elements]
+
+
+def report_sample(variant_report):
+    if interner.enabled:
+        return interner.resolve_sample(variant_report, extract_sample)
+    return extract_sample(variant_report)
+
+
+def evidence_sample(element, sample_id):
+    dna_samples = [name for name, nucleic_acid_type in iter_evidence(element) if nucleic_acid_type == 'DNA']
+    return dna_samples[0] if dna_samples else sample_id
+
+
+def iter_short_variants(results_payload_dict, mappings=None):
+    variant_report = results_payload_dict['variant-report']
+    _, interpretation_map = mappings or (STATUS_MAP, INTERPRETATION_MAP)
+    intern = interner.intern if interner.enabled else passthrough
+    sample_id = report_sample(variant_report)
+
+    for variant in section_elements(variant_report, 'short-variants', 'short-variant'):
+        chromosome, _, position = (variant.get('@position') or '').partition(':')
+        yield {'sample_id': intern(evidence_sample(variant, sample_id)),
+               'gene': intern(variant.get('@gene')),
+               'chromosome': intern(chromosome),
+               'position': position,
+               'cds_effect': variant.get('@cds-effect'),
+               'protein_effect': variant.get('@protein-effect'),
+               'functional_effect': intern(variant.get('@functional-effect')),
+               'transcript': intern(variant.get('@transcript')),
+               'allele_fraction': variant.get('@allele-fraction'),
+               'depth': variant.get('@depth'),
+               'status': intern(variant.get('@status')),
+               'interpretation': calculate_interpretation(variant.get('@status'), interpretation_map)}
+
+
+def iter_rearrangements(results_payload_dict, mappings=None):
+    variant_report = results_payload_dict['variant-report']
+    _, interpretation_map = mappings or (STATUS_MAP, INTERPRETATION_MAP)
+    intern = interner.intern if interner.enabled else passthrough
+    sample_id = report_sample(variant_report)
+
+    for rearrangement in section_elements(variant_report, 'rearrangements', 'rearrangement'):
+        yield {'sample_id': intern(evidence_sample(rearrangement, sample_id)),
+               'targeted_gene': intern(rearrangement.get('@targeted-gene')),
+               'other_gene': intern(rearrangement.get('@other-gene')),
+               'type': intern(rearrangement.get('@type')),
+               'pos1': rearrangement.get('@pos1'),
+               'pos2': rearrangement.get('@pos2'),
+               'in_frame': intern(rearrangement.get('@in-frame')),
+               'allele_fraction': rearrangement.get('@allele-fraction'),
+               'supporting_read_pairs': rearrangement.get('@supporting-read-pairs'),
+               'status': intern(rearrangement.get('@status')),
+               'interpretation': calculate_interpretation(rearrangement.get('@status'), interpretation_map)}
+
+
+def iter_biomarkers(results_payload_dict, mappings=None):
+    # Every child of <biomarkers> (microsatellite-instability, tumor-mutation-burden, ...) is one row
+    variant_report = results_payload_dict['variant-report']
+    sample_id = report_sample(variant_report)
+
+    for biomarker, elements in (variant_report.get('biomarkers') or {}).items():
+        if biomarker.startswith(('@', '#')):
+            continue
+        for element in elements if isinstance(elements, list) else [elements]:
+            element = element or {}
+            yield {'sample_id': sample_id,
+                   'biomarker': biomarker,
+                   'status': element.get('@status'),
+                   'score': element.get('@score'),
+                   'unit': element.get('@unit')}
+
+
+SECTION_EXTRACTORS = {
+    'short-variants': iter_short_variants,
+    'rearrangements': iter_rearrangements,
+    'biomarkers': iter_biomarkers,
+}
+
+
+def iter_section(section, results_payload_dict, mappings, args):
+    if section == 'copy-numbers':
+        return iter_copy_numbers(results_payload_dict, mappings, all_samples(args), validation_mode(args))
+    return SECTION_EXTRACTORS[section](results_payload_dict, mappings)
+
+
+def section_output(out_file, section):
+    # report.csv.gz -> report.short-variants.csv.gz
+    compressed = '.gz' if out_file.endswith('.gz') else ''
+    base, extension = os.path.splitext(out_file[:len(out_file) - len(compressed)])
+    return '%s.%s%s%s' % (base, section, extension, compressed)
+
+
+def read_sections(xml_file, sections, args):
+    # The report is parsed once, keeping only the requested sections, and every section is extracted from it
+    mappings = load_mappings(args.mapping_file)
+    with metrics.timer('read_xml'):
+        xml_dict = read_xml(xml_file, args.stream, args.parser, xml_sections(sections))
+    results_payload_dict = xml_dict['rr:ResultsReport']['rr:ResultsPayload']
+
+    section_rows = OrderedDict()
+    for section in sections:
+        name = section.replace('-', '_')
+        section_rows[section] = metrics.timed('extract_' + name, iter_section(
+            section, results_payload_dict, mappings, args), 'alterations' if section == 'copy-numbers' else name)
+    return section_rows
+
+
+def write_sections(section_rows, args):
+    # Copy numbers keep the output path; every other section is written beside it
+    output_format = getattr(args, 'format', 'csv')
+    if set(section_rows) - {'copy-numbers'}:
+        if output_format not in SECTION_FORMATS:
+            raise ValueError('The %s format only holds copy numbers' % output_format)
+        if not isinstance(args.out_file, str) or args.out_file == '-':
+            raise ValueError('Section outputs need an output path')
+
+    for section, rows in section_rows.items():
+        if section == 'copy-numbers':
+            write_copy_numbers_to_cnv({'CopyNumbers': rows}, args)
+            continue
+
+        logger.info('Saving %s to %s file', section, output_format)
+        with metrics.timer('write_' + section.replace('-', '_')):
+            OUTPUT_WRITERS[output_format](rows, section_output(args.out_file, section), SECTION_FIELDS[section])
+
+
+def convert_sections(xml_file, sections, args):
+    write_sections(read_sections(xml_file, sections, args), args)
@@ -0,0 +1,207 @@
+import argparse
+import io
+import json
+import logging
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from src import configure_logging
+from src.batch import convert_one
+from src.convert import (BINARY_FORMATS, OUTPUT_WRITERS, XML_PARSERS, iter_copy_numbers, load_mappings, parse_xml,
+                         pop_unresolved_values, report_unresolved_values)
+from src.validation import pop_validation_errors, report_validation_errors
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+    'table': 'application/octet-stream',
+}
+
+
+def convert_xml(xml_bytes, output_format, mapping_file=None, parser='xmltodict'):
+    xml_dict = parse_xml(xml_bytes, parser=parser)
+    copy_numbers = iter_copy_numbers(xml_dict['rr:ResultsReport']['rr:ResultsPayload'], load_mappings(mapping_file))
+
+    if output_format in BINARY_FORMATS:
+        out = io.BytesIO()
+        OUTPUT_WRITERS[output_format](copy_numbers, out)
+        body = out.getvalue()
+    else:
+        out = io.StringIO()
+        OUTPUT_WRITERS[output_format](copy_numbers, out)
+        body = out.getvalue().encode('utf-8')
+    return body
+
+
+def convert_request(xml_bytes, output_format, mapping_file=None, parser='xmltodict'):
+    # Runs in a worker process; the values the report left unresolved are handed back with the body so the
+    # server reports them, and are cleared either way so they never leak into the next request
+    try:
+        body = convert_xml(xml_bytes, output_format, mapping_file, parser)
+    finally:
+        unresolved, invalid = pop_unresolved_values(), pop_validation_errors()
+    return body, unresolved, invalid
+
+
+class ConvertHandler(BaseHTTPRequestHandler):
+    executor = None
+    mapping_file = None
+    parser = 'xmltodict'
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self.respond(200, b'ok\n', 'text/plain')
+        else:
+            self.respond(404, b'not found\n', 'text/plain')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/convert':
+            self.respond(404, b'not found\n', 'text/plain')
+            return
+
+        output_format = parse_qs(url.query).get('format', ['csv'])[0]
+        if output_format not in OUTPUT_WRITERS:
+            self.respond(400, ('unknown format: %s\n' % output_format).encode('utf-8'), 'text/plain')
+            return
+
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            self.respond(400, b'invalid Content-Length\n', 'text/plain')
+            return
+
+        xml_bytes = self.rfile.read(content_length)
+        try:
+            body, unresolved, invalid = self.executor.submit(convert_request, xml_bytes, output_format,
+                                                             self.mapping_file, self.parser).result()
+        except Exception as ex:
+            logger.error('Failed to convert request: %s', ex)
+            self.respond(400, ('failed to convert report: %r\n' % ex).encode('utf-8'), 'text/plain')
+            return
+
+        report_unresolved_values(unresolved)
+        report_validation_errors(invalid)
+        headers = [('X-Unresolved-Values', json.dumps(unresolved, sort_keys=True))] if unresolved else []
+        self.respond(200, body, CONTENT_TYPES[output_format], headers)
+
+    def respond(self, status, body, content_type, headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info(format, *args)
+
+
+def serve_http(host, port, executor, mapping_file=None, parser='xmltodict'):
+    handler = type('Handler', (ConvertHandler,), {'executor': executor, 'mapping_file': mapping_file,
+                                                  'parser': parser})
+    server = ThreadingHTTPServer((host, port), handler)
+    logger.info('Serving conversions on http://%s:%d', host, server.server_port)
+    return server
+
+
+def serve_stdio(executor, args, stdin=sys.stdin, stdout=sys.stdout):
+    # Each input line is a JSON job {"id", "xml_file", "out_file"}; each output line is the
+    # matching batch result, written as soon as that job finishes.
+    lock = threading.Lock()
+    responded = []
+
+    def write_result(job_id, result):
+        with lock:
+            stdout.write(json.dumps(dict(result, id=job_id)) + '\n')
+            stdout.flush()
+
+    def respond(job_id, future, event):
+        try:
+            result = future.result()
+        except Exception as ex:
+            result = {'status': 'failure', 'error': repr(ex)}
+        write_result(job_id, result)
+        event.set()
+
+    for line in stdin:
+        if not line.strip():
+            continue
+        # A malformed job line fails that job only; the worker keeps serving the others
+        job_id = None
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict):
+                raise ValueError('job must be a JSON object')
+            job_id = job.get('id')
+            xml_file, out_file = job['xml_file'], job['out_file']
+            output_format = job.get('format', args.format)
+            if output_format not in OUTPUT_WRITERS:
+                raise ValueError('unknown format: %s' % output_format)
+        except (KeyError, ValueError) as ex:
+            logger.error('Invalid job %r: %r', line.strip(), ex)
+            write_result(job_id, {'status': 'failure', 'error': repr(ex)})
+            continue
+
+        job_args = argparse.Namespace(**dict(vars(args), format=output_format))
+        event = threading.Event()
+        future = executor.submit(convert_one, (xml_file, out_file), job_args)
+        future.add_done_callback(lambda done, job_id=job_id, event=event: respond(job_id, done, event))
+        responded.append(event)
+
+    for event in responded:
+        event.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='foundation-xml-cnv-server',
+        description='Keeps warm worker processes converting FoundationOne XML reports over HTTP or stdin/stdout.')
+    modes = parser.add_mutually_exclusive_group(required=True)
+    modes.add_argument('--port', dest='port', type=int,
+                       help='Serve POST /convert?format=csv|ndjson|parquet|table on this port')
+    modes.add_argument('--stdio', dest='stdio', action='store_true',
+                       help='Read JSON jobs from stdin and write JSON results to stdout, one per line')
+    parser.add_argument('--host', dest='host', default='0.0.0.0', help='Address to bind the HTTP server to')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=1,
+                        help='Number of worker processes converting reports concurrently')
+    parser.add_argument('--stream', dest='stream', action='store_true',
+                        help='Stream the XML of stdio jobs, keeping only the samples and copy number alterations')
+    parser.add_argument('--parser', dest='parser', choices=sorted(XML_PARSERS), default='xmltodict',
+                        help='XML parser backend; expat only builds the elements used for extraction')
+    parser.add_argument('--prescan', dest='prescan', action='store_true',
+                        help='Write an empty output without parsing for stdio jobs with no copy-number-alteration '
+                             'elements')
+    parser.add_argument('--mappings', dest='mapping_file',
+                        help='JSON or YAML file overriding the status and interpretation mappings')
+    parser.add_argument('-f', '--format', dest='format', choices=sorted(OUTPUT_WRITERS), default='csv',
+                        help='Default output format of stdio jobs')
+    parser.add_argument('--cache-dir', dest='cache_dir',
+                        help='Directory caching extracted rows of stdio jobs by report content')
+    args = parser.parse_args()
+    configure_logging()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        if args.stdio:
+            serve_stdio(executor, argparse.Namespace(stream=args.stream, mapping_file=args.mapping_file,
+                                                     format=args.format, cache_dir=args.cache_dir,
+                                                     prescan=args.prescan, parser=args.parser))
+        else:
+            server = serve_http(args.host, args.port, executor, args.mapping_file, args.parser)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+import json
+import math
+import struct
+import sys
+from array import array
+from collections import Counter
+
+from src.inputs import open_input
+
+MAGIC = b'CNVTABLE1\n'
+
+# Repeated strings are stored once per table and referenced by 4-byte codes
+CATEGORICAL_COLUMNS = ['sample_id', 'gene', 'status', 'chromosome', 'interpretation', 'source_file',
+                       'nucleic_acid_type', 'number_of_exons', 'copy_type', 'copy_status', 'ratio_text']
+
+# Row fields only some outputs have; rows only carry them when they are set
+OPTIONAL_COLUMNS = ['source_file', 'nucleic_acid_type']
+
+NUMERIC_COLUMNS = [('copy_number', 'd'), ('start_position', 'q'), ('end_position', 'q'), ('ratio', 'd')]
+
+# Row attributes and the categorical columns holding them
+ATTRIBUTE_COLUMNS = [('number-of-exons', 'number_of_exons'), ('status', 'copy_type'),
+                     ('interpretation', 'copy_status')]
+
+# Columns added after tables were first written; older tables read back with them unset
+ADDED_COLUMNS = OPTIONAL_COLUMNS + ['ratio_text']
+
+CODE_TYPE = 'I'
+
+
+def ratio_value(ratio):
+    # The float column holds every numeric ratio. The original value is kept in ratio_text only when the float
+    # does not give it back ('2.10', 'NA', a float read from NDJSON), so the common case costs no vocabulary entry.
+    # A NaN float reads back as no ratio, so a ratio written as 'nan' keeps its text too.
+    try:
+        value = float(ratio)
+    except (TypeError, ValueError):
+        return math.nan, ratio
+    exact = isinstance(ratio, str) and repr(value) == ratio and not math.isnan(value)
+    return value, None if exact else ratio
+
+
+def positions(column, codes):
+    # The codes are searched for in the raw column bytes, which runs in C, so finding the rows of a few
+    # codes avoids a Python-level pass over the column
+    data = column.tobytes()
+    itemsize = column.itemsize
+    indices = []
+    for code in codes:
+        pattern = array(column.typecode, [code]).tobytes()
+        offset = data.find(pattern)
+        while offset != -1:
+            if offset % itemsize == 0:
+                indices.append(offset // itemsize)
+                offset = data.find(pattern, offset + itemsize)
+            else:
+                offset = data.find(pattern, offset + 1)
+    return sorted(indices)
+
+
+class CopyNumberTable(object):
+
+    def __init__(self):
+        self.vocabularies = {name: [] for name in CATEGORICAL_COLUMNS}
+        self.lookups = {name: {} for name in CATEGORICAL_COLUMNS}
+        self.columns = {name: array(CODE_TYPE) for name in CATEGORICAL_COLUMNS}
+        self.columns.update((name, array(typecode)) for name, typecode in NUMERIC_COLUMNS)
+
+    def __len__(self):
+        return len(self.columns['gene'])
+
+    def __iter__(self):
+        return self.to_dicts()
+
+    @property
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in self.columns.values())
+
+    def code(self, name, value):
+        lookup = self.lookups[name]
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(self.vocabularies[name])
+            self.vocabularies[name].append(value)
+        return code
+
+    def append(self, cnv):
+        attributes = cnv.get('attributes') or {}
+        columns = self.columns
+        for name in ['sample_id', 'gene', 'status', 'chromosome', 'interpretation'] + OPTIONAL_COLUMNS:
+            columns[name].append(self.code(name, cnv.get(name)))
+        for attribute, name in ATTRIBUTE_COLUMNS:
+            columns[name].append(self.code(name, attributes.get(attribute)))
+        columns['copy_number'].append(float(cnv['copy_number']))
+        columns['start_position'].append(int(cnv['start_position']))
+        columns['end_position'].append(int(cnv['end_position']))
+        value, text = ratio_value(attributes.get('ratio'))
+        columns['ratio'].append(value)
+        columns['ratio_text'].append(self.code('ratio_text', text))
+
+    def extend(self, copy_numbers):
+        for cnv in copy_numbers:
+            self.append(cnv)
+        return self
+
+    @classmethod
+    def from_dicts(cls, copy_numbers):
+        return cls().extend(copy_numbers)
+
+    def row(self, index):
+        columns = self.columns
+        vocabularies = self.vocabularies
+
+        # Attributes are rebuilt in the order gather_attributes produces them, leaving out missing ones
+        attributes = {}
+        number_of_exons = vocabularies['number_of_exons'][columns['number_of_exons'][index]]
+        if number_of_exons is not None:
+            attributes['number-of-exons'] = number_of_exons
+        copy_type = vocabularies['copy_type'][columns['copy_type'][index]]
+        if copy_type is not None:
+            attributes['status'] = copy_type
+        ratio = vocabularies['ratio_text'][columns['ratio_text'][index]]
+        if ratio is None and not math.isnan(columns['ratio'][index]):
+            ratio = repr(columns['ratio'][index])
+        if ratio is not None:
+            attributes['ratio'] = ratio
+        copy_status = vocabularies['copy_status'][columns['copy_status'][index]]
+        if copy_status is not None:
+            attributes['interpretation'] = copy_status
+
+        # Positions and attribute values come back as strings, the way extraction produces them from the XML
+        cnv = {'sample_id': vocabularies['sample_id'][columns['sample_id'][index]],
+               'gene': vocabularies['gene'][columns['gene'][index]],
+               'copy_number': columns['copy_number'][index],
+               'status': vocabularies['status'][columns['status'][index]],
+               'attributes': attributes,
+               'chromosome': vocabularies['chromosome'][columns['chromosome'][index]],
+               'start_position': str(columns['start_position'][index]),
+               'end_position': str(columns['end_position'][index]),
+               'interpretation': vocabularies['interpretation'][columns['interpretation'][index]]}
+        for name in OPTIONAL_COLUMNS:
+            value = vocabularies[name][columns[name][index]]
+            if value is not None:
+                cnv[name] = value
+        return cnv
+
+    def to_dicts(self):
+        for index in range(len(self)):
+            yield self.row(index)
+
+    def take(self, indices):
+        if not isinstance(indices, list):
+            indices = list(indices)
+        table = CopyNumberTable()
+        # Vocabularies are copied whole so the codes of the selected rows stay valid
+        table.vocabularies = {name: list(values) for name, values in self.vocabularies.items()}
+        table.lookups = {name: dict(lookup) for name, lookup in self.lookups.items()}
+        for name, column in self.columns.items():
+            table.columns[name] = array(column.typecode, map(column.__getitem__, indices))
+        return table
+
+    def codes(self, name, values):
+        if isinstance(values, str) or values is None:
+            values = [values]
+        return {self.lookups[name][value] for value in values if value in self.lookups[name]}
+
+    def select(self, gene=None, status=None, sample_id=None, interpretation=None, source_file=None):
+        # Each filter compares the integer codes of one column; filters given together are combined
+        indices = None
+        for name, values in [('gene', gene), ('status', status), ('sample_id', sample_id),
+                             ('interpretation', interpretation), ('source_file', source_file)]:
+            if values is None:
+                continue
+            codes = self.codes(name, values)
+            column = self.columns[name]
+            if indices is None:
+                indices = positions(column, codes)
+            else:
+                indices = [index for index in indices if column[index] in codes]
+        return self.take(range(len(self)) if indices is None else indices)
+
+    def overlapping(self, chromosome, start, end):
+        starts = self.columns['start_position']
+        ends = self.columns['end_position']
+        return self.take(index for index in positions(self.columns['chromosome'], self.codes('chromosome', chromosome))
+                         if starts[index] <= end and ends[index] >= start)
+
+    def value_counts(self, name):
+        vocabulary = self.vocabularies[name]
+        return Counter({vocabulary[code]: count for code, count in Counter(self.columns[name]).items()})
+
+    def concat(self, other):
+        # Codes of the other table are remapped into this table's vocabularies
+        for name in CATEGORICAL_COLUMNS:
+            remap = [self.code(name, value) for value in other.vocabularies[name]]
+            self.columns[name].extend(array(CODE_TYPE, [remap[code] for code in other.columns[name]]))
+        for name, _ in NUMERIC_COLUMNS:
+            self.columns[name].extend(other.columns[name])
+        return self
+
+    def write(self, fd):
+        header = json.dumps({
+            'rows': len(self),
+            'byteorder': sys.byteorder,
+            'vocabularies': self.vocabularies,
+            'columns': [[name, column.typecode] for name, column in self.columns.items()],
+        }).encode('utf-8')
+        fd.write(MAGIC)
+        fd.write(struct.pack('<Q', len(header)))
+        fd.write(header)
+        for column in self.columns.values():
+            fd.write(column.tobytes())
+
+    @classmethod
+    def read(cls, fd):
+        if fd.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not a copy number table')
+        header = json.loads(fd.read(struct.unpack('<Q', fd.read(8))[0]).decode('utf-8'))
+
+        table = cls()
+        table.vocabularies.update(header['vocabularies'])
+        table.lookups = {name: {value: code for code, value in enumerate(values)}
+                         for name, values in table.vocabularies.items()}
+        # Columns added after a table was written read back as unset
+        for name in ADDED_COLUMNS:
+            if name not in header['vocabularies']:
+                table.columns[name] = array(CODE_TYPE, [table.code(name, None)]) * header['rows']
+        for name, typecode in header['columns']:
+            column = array(typecode)
+            column.frombytes(fd.read(column.itemsize * header['rows']))
+            if len(column) != header['rows']:
+                raise ValueError('Truncated copy number table column %s' % name)
+            if header['byteorder'] != sys.byteorder:
+                column.byteswap()
+            table.columns[name] = column
+        return table
+
+    def save(self, out_file):
+        with open(out_file, 'wb') as fd:
+            self.write(fd)
+
+    @classmethod
+    def load(cls, table_file):
+        with open_input(table_file) as fd:
+            return cls.read(fd)
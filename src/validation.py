@@ -0,0 +1,86 @@
+import json
+import logging
+import re
+
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+VALIDATION_MODES = ['strict', 'lenient']
+
+POSITION_PATTERN = re.compile(r'^([^:]+):(\d+)-(\d+)$')
+
+
+def is_number(value):
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+# Attributes every copy-number-alteration must carry, and the checks for those whose values are parsed; these
+# match what extraction itself does with the values, so an element passes exactly when it can be extracted
+REQUIRED_ATTRIBUTES = ['@copy-number', '@equivocal', '@gene', '@position', '@status', '@type']
+
+ATTRIBUTE_FORMATS = [
+    ('@position', POSITION_PATTERN.match, 'chromosome:start-end'),
+    ('@copy-number', is_number, 'a number'),
+]
+
+validation_errors = []
+
+
+class ValidationError(ValueError):
+
+    def __init__(self, errors):
+        super(ValidationError, self).__init__('; '.join(format_error(error) for error in errors))
+        self.errors = errors
+
+
+def format_error(error):
+    message = '%s %d (gene %s, line %s): %s %s' % (error['element'], error['index'], error['gene'], error['line'],
+                                                    error['attribute'], error['problem'])
+    return '%s: %s' % (error['xml_file'], message) if 'xml_file' in error else message
+
+
+def element_errors(element, index, tag):
+    # Collects every problem of the element rather than stopping at the first. Empty and text-only elements
+    # come out of xmltodict as None or a string, and have none of the attributes
+    if not isinstance(element, dict):
+        element = {}
+    context = {'element': tag, 'index': index, 'gene': element.get('@gene'), 'line': getattr(element, 'line', None)}
+    errors = [dict(context, attribute=attribute[1:], value=None, problem='is missing')
+              for attribute in REQUIRED_ATTRIBUTES if attribute not in element]
+    errors.extend(dict(context, attribute=attribute[1:], value=element[attribute], problem='is not ' + expected)
+                  for attribute, check, expected in ATTRIBUTE_FORMATS
+                  if attribute in element and not check(element[attribute]))
+    return errors
+
+
+def invalid_copy_number(copy_number, index, mode='strict'):
+    # Called once extracting the element has failed; returns False when the failure is not a validation problem
+    errors = element_errors(copy_number, index, 'copy-number-alteration')
+    if not errors:
+        return False
+    if mode == 'strict':
+        raise ValidationError(errors)
+    metrics.increment('alterations_invalid')
+    validation_errors.extend(errors)
+    return True
+
+
+def pop_validation_errors():
+    errors = list(validation_errors)
+    del validation_errors[:]
+    return errors
+
+
+def report_validation_errors(errors, errors_file=None):
+    for error in errors:
+        logger.warning('Skipped invalid %s', format_error(error))
+    if errors_file:
+        with open(errors_file, 'w') as fd:
+            for error in errors:
+                fd.write(json.dumps(error))
+                fd.write('\n')
@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import gzip
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from unittest import TestCase, mock
+from src.batch import collect_batch
+from src.batch import convert_batch
+from src.batch import convert_many_async
+from src.batch import find_reports
+from src.batch import main
+from src.batch import merge_batch
+from src.batch import read_manifest
+from src.batch import shared_outputs
+from src.journal import Journal
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def batch_args(**kwargs):
+    return argparse.Namespace(**dict({'stream': False, 'jobs': 1, 'mapping_file': None, 'format': 'csv',
+                                        'merge_file': None, 'append': False, 'cache_dir': None,
+                                        'prescan': False, 'parser': 'xmltodict'}, **kwargs))
+
+
+class BatchTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_find_reports_in_directory(self):
+        reports = find_reports(DATA_DIR, self.tmp_dir)
+        self.assertEqual([
+            (os.path.join(DATA_DIR, 'foundation_report.xml'), os.path.join(self.tmp_dir, 'foundation_report.csv')),
+            (os.path.join(DATA_DIR, 'foundation_report_no_copy_numbers.xml'),
+             os.path.join(self.tmp_dir, 'foundation_report_no_copy_numbers.csv'))
+        ], reports)
+
+    def test_find_reports_with_glob(self):
+        reports = find_reports(os.path.join(DATA_DIR, '*_no_*.xml'), self.tmp_dir)
+        self.assertEqual([
+            (os.path.join(DATA_DIR, 'foundation_report_no_copy_numbers.xml'),
+             os.path.join(self.tmp_dir, 'foundation_report_no_copy_numbers.csv'))
+        ], reports)
+
+    def test_find_reports_in_archive(self):
+        zip_file = os.path.join(self.tmp_dir, 'reports.zip')
+        with zipfile.ZipFile(zip_file, 'w') as archive:
+            archive.write(os.path.join(DATA_DIR, 'foundation_report.xml'), 'a/foundation_report.xml')
+            archive.writestr('a/README.txt', 'not a report')
+            archive.writestr('b/report.xml.gz', gzip.compress(b'<report/>'))
+        self.assertEqual([
+            (zip_file + '::a/foundation_report.xml', os.path.join(self.tmp_dir, 'foundation_report.csv')),
+            (zip_file + '::b/report.xml.gz', os.path.join(self.tmp_dir, 'report.csv'))
+        ], find_reports(zip_file, self.tmp_dir))
+
+    def test_convert_batch_from_archive(self):
+        expected_dir = os.path.join(self.tmp_dir, 'expected')
+        os.makedirs(expected_dir)
+        convert_batch(find_reports(DATA_DIR, expected_dir), batch_args())
+
+        tar_file = os.path.join(self.tmp_dir, 'reports.tar.gz')
+        with tarfile.open(tar_file, 'w:gz') as archive:
+            archive.add(DATA_DIR, 'data')
+        for use_async in [False, True]:
+            out_dir = os.path.join(self.tmp_dir, 'async' if use_async else 'serial')
+            os.makedirs(out_dir)
+            reports = find_reports(tar_file, out_dir)
+            if use_async:
+                results = asyncio.run(convert_many_async(reports, batch_args()))
+            else:
+                results = convert_batch(reports, batch_args(jobs=2))
+
+            self.assertEqual(['success', 'success'], [result['status'] for result in results])
+            for name in os.listdir(expected_dir):
+                with open(os.path.join(expected_dir, name)) as expected, open(os.path.join(out_dir, name)) as fd:
+                    self.assertEqual(expected.read(), fd.read())
+
+    def test_convert_batch_reads_tar_once(self):
+        tar_file = os.path.join(self.tmp_dir, 'reports.tar.gz')
+        with tarfile.open(tar_file, 'w:gz') as archive:
+            for i in range(6):
+                archive.add(os.path.join(DATA_DIR, 'foundation_report.xml'), 'report%d.xml' % i)
+        reports = find_reports(tar_file, self.tmp_dir)
+        journal = Journal(os.path.join(self.tmp_dir, 'journal.sqlite'))
+
+        with mock.patch('tarfile.open', wraps=tarfile.open) as tar_open:
+            results = convert_batch(reports, batch_args(journal_file='journal.sqlite'), journal)
+            self.assertEqual(['success'] * 6, [result['status'] for result in results])
+            self.assertEqual(1, tar_open.call_count)
+
+            # A touched archive is rehashed in one pass too
+            os.utime(tar_file, (0, 0))
+            self.assertEqual([], journal.pending(reports))
+            self.assertEqual(2, tar_open.call_count)
+
+            # Members out of archive order are held from a single pass until their turn; a member the archive
+            # does not have only costs the worker's own attempt to open it
+            missing = (tar_file + '::missing.xml', os.path.join(self.tmp_dir, 'missing.csv'))
+            results = convert_batch(reports[::-1] + [missing] + reports[:1], batch_args())
+            self.assertEqual(['success'] * 6 + ['failure', 'success'], [result['status'] for result in results])
+            self.assertEqual(2 + 2, tar_open.call_count)
+        journal.close()
+
+    def test_shared_outputs(self):
+        for name in ['r.xml', 'r.xml.gz', 'other.xml']:
+            shutil.copy(os.path.join(DATA_DIR, 'foundation_report.xml'), os.path.join(self.tmp_dir, name))
+        zip_file = os.path.join(self.tmp_dir, 'bundle.zip')
+        with zipfile.ZipFile(zip_file, 'w') as archive:
+            archive.write(os.path.join(DATA_DIR, 'foundation_report.xml'), 'a/report.xml')
+            archive.write(os.path.join(DATA_DIR, 'foundation_report.xml'), 'b/report.xml')
+
+        self.assertEqual([os.path.join('out', 'r.csv')], shared_outputs(find_reports(self.tmp_dir, 'out')))
+        self.assertEqual([os.path.join('out', 'report.csv')], shared_outputs(find_reports(zip_file, 'out')))
+        self.assertEqual([], shared_outputs(find_reports(DATA_DIR, 'out')))
+
+    def test_append_needs_a_text_format(self):
+        for output_format in ['parquet', 'table']:
+            argv = ['batch', '-i', DATA_DIR, '--merge', os.path.join(self.tmp_dir, 'out.' + output_format),
+                    '--append', '-f', output_format]
+            with mock.patch('sys.argv', argv), mock.patch('sys.stderr'), self.assertRaises(SystemExit) as context:
+                main()
+            self.assertEqual(2, context.exception.code)
+        self.assertEqual([], os.listdir(self.tmp_dir))
+
+    def test_read_manifest(self):
+        manifest_file = os.path.join(self.tmp_dir, 'manifest.csv')
+        with open(manifest_file, 'w') as fd:
+            fd.write('a.xml,a.csv\n\nb.xml, b.csv\n')
+        self.assertEqual([('a.xml', 'a.csv'), ('b.xml', 'b.csv')], read_manifest(manifest_file))
+
+    def test_convert_batch_skips_malformed_reports(self):
+        malformed_file = os.path.join(self.tmp_dir, 'malformed.xml')
+        with open(malformed_file, 'w') as fd:
+            fd.write('<rr:ResultsReport><variant-report>')
+        reports = [(malformed_file, os.path.join(self.tmp_dir, 'malformed.csv'))]
+        reports += find_reports(DATA_DIR, self.tmp_dir)
+
+        results = convert_batch(reports, batch_args())
+
+        self.assertEqual(['failure', 'success', 'success'], [result['status'] for result in results])
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'malformed.csv')))
+        with open(os.path.join(self.tmp_dir, 'foundation_report.csv')) as fd:
+            self.assertEqual(6, len(fd.readlines()))
+
+    def test_convert_batch_in_parallel_matches_serial(self):
+        serial_dir = os.path.join(self.tmp_dir, 'serial')
+        parallel_dir = os.path.join(self.tmp_dir, 'parallel')
+        os.makedirs(serial_dir)
+        os.makedirs(parallel_dir)
+        serial_reports = find_reports(DATA_DIR, serial_dir) * 3
+        parallel_reports = find_reports(DATA_DIR, parallel_dir) * 3
+
+        serial_results = convert_batch(serial_reports, batch_args())
+        parallel_results = convert_batch(parallel_reports, batch_args(jobs=2))
+
+        self.assertEqual([result['xml_file'] for result in serial_results],
+                         [result['xml_file'] for result in parallel_results])
+        self.assertEqual([result['status'] for result in serial_results],
+                         [result['status'] for result in parallel_results])
+        for name in os.listdir(serial_dir):
+            with open(os.path.join(serial_dir, name)) as serial, open(os.path.join(parallel_dir, name)) as parallel:
+                self.assertEqual(serial.read(), parallel.read())
+
+    def test_merge_batch_writes_one_header(self):
+        merge_file = os.path.join(self.tmp_dir, 'cohort.csv.gz')
+        reports = find_reports(DATA_DIR, '')
+
+        merge_batch(reports, batch_args(merge_file=merge_file))
+        results = merge_batch(reports, batch_args(merge_file=merge_file, append=True, jobs=2))
+
+        self.assertEqual(['success', 'success'], [result['status'] for result in results])
+        with gzip.open(merge_file, 'rt') as fd:
+            lines = fd.read().splitlines()
+        self.assertEqual(11, len(lines))
+        self.assertTrue(lines[0].endswith(',interpretation,source_file'))
+        self.assertTrue(lines[1].endswith(',Pathogenic,' + os.path.join(DATA_DIR, 'foundation_report.xml')))
+        self.assertEqual(lines[1:6], lines[6:11])
+
+    def test_collect_batch_shares_strings_across_reports(self):
+        xml_file = os.path.join(DATA_DIR, 'foundation_report.xml')
+        reports = [(xml_file, None), (xml_file, None)]
+        for jobs in [1, 2]:
+            results, rows = collect_batch(reports, batch_args(jobs=jobs))
+
+            self.assertEqual(['success', 'success'], [result['status'] for result in results])
+            self.assertEqual(10, len(rows))
+            self.assertEqual(rows[:5], rows[5:])
+            for field in ['sample_id', 'gene', 'chromosome', 'status', 'source_file']:
+                self.assertIs(rows[0][field], rows[5][field])
+            self.assertIs(rows[0]['attributes']['number-of-exons'], rows[5]['attributes']['number-of-exons'])
+
+    def test_convert_many_async_matches_serial(self):
+        serial_dir = os.path.join(self.tmp_dir, 'serial')
+        async_dir = os.path.join(self.tmp_dir, 'async')
+        os.makedirs(serial_dir)
+        os.makedirs(async_dir)
+        missing = (os.path.join(self.tmp_dir, 'missing.xml'), os.path.join(async_dir, 'missing.csv'))
+
+        convert_batch(find_reports(DATA_DIR, serial_dir), batch_args())
+        for jobs in [1, 2]:
+            results = asyncio.run(convert_many_async(find_reports(DATA_DIR, async_dir) + [missing],
+                                                     batch_args(jobs=jobs), concurrency=2))
+
+            self.assertEqual(['success', 'success', 'failure'], [result['status'] for result in results])
+            self.assertEqual(sorted(os.listdir(serial_dir)), sorted(os.listdir(async_dir)))
+            for name in os.listdir(serial_dir):
+                with open(os.path.join(serial_dir, name)) as serial, open(os.path.join(async_dir, name)) as converted:
+                    self.assertEqual(serial.read(), converted.read())
+
+    def test_convert_batch_with_cache(self):
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+        reports = find_reports(DATA_DIR, self.tmp_dir)
+        convert_batch(reports, batch_args())
+        with open(reports[0][1]) as fd:
+            uncached = fd.read()
+
+        for jobs in [1, 2]:
+            results = convert_batch(reports, batch_args(cache_dir=cache_dir, jobs=jobs))
+            self.assertEqual(['success', 'success'], [result['status'] for result in results])
+            with open(reports[0][1]) as fd:
+                self.assertEqual(uncached, fd.read())
+        self.assertEqual(2, sum(len(files) for _, _, files in os.walk(cache_dir)))
+
+    def test_convert_batch_with_prescan(self):
+        reports = find_reports(DATA_DIR, self.tmp_dir)
+        expected = []
+        for report in reports:
+            convert_batch([report], batch_args())
+            with open(report[1]) as fd:
+                expected.append(fd.read())
+
+        for use_async in [False, True]:
+            if use_async:
+                asyncio.run(convert_many_async(reports, batch_args(prescan=True)))
+            else:
+                convert_batch(reports, batch_args(prescan=True))
+            for report, contents in zip(reports, expected):
+                with open(report[1]) as fd:
+                    self.assertEqual(contents, fd.read())
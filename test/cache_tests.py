@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from src.cache import ResultCache
+from src.cache import report_key
+from src.convert import load_mappings
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class CacheTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_report_key_depends_on_content_and_mappings(self):
+        xml_file = os.path.join(DATA_DIR, 'foundation_report.xml')
+        key = report_key(xml_file, load_mappings())
+        self.assertEqual(key, report_key(xml_file, load_mappings()))
+        self.assertNotEqual(key, report_key(xml_file, load_mappings(os.path.join(DATA_DIR, 'mappings.json'))))
+        self.assertNotEqual(key, report_key(os.path.join(DATA_DIR, 'foundation_report_no_copy_numbers.xml'),
+                                            load_mappings()))
+
+    def test_get_and_put(self):
+        cache = ResultCache(self.tmp_dir)
+        entry = {'rows': [{'gene': 'CDK4', 'copy_number': 44.0, 'attributes': {'ratio': '11.63'}}], 'unresolved': {}}
+        self.assertIsNone(cache.get('ab12'))
+        cache.put('ab12', entry)
+        self.assertEqual(entry, cache.get('ab12'))
+
+    def test_evict_least_recently_used(self):
+        cache = ResultCache(self.tmp_dir, max_bytes=0)
+        for key in ['aa01', 'bb02', 'cc03']:
+            cache.put(key, {'rows': [], 'unresolved': {}})
+        cache.max_bytes = os.path.getsize(cache.path('aa01')) * 2
+        now = time.time()
+        os.utime(cache.path('aa01'), (now - 10, now - 10))
+        os.utime(cache.path('bb02'), (now - 20, now - 20))
+        os.utime(cache.path('cc03'), (now - 30, now - 30))
+        cache.get('cc03')
+
+        self.assertEqual(1, cache.evict())
+        self.assertIsNotNone(cache.get('aa01'))
+        self.assertIsNone(cache.get('bb02'))
+        self.assertIsNotNone(cache.get('cc03'))
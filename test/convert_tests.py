@@ -1,9 +1,37 @@
-from unittest import TestCase
+import argparse
+import bz2
+import gzip
+import importlib.util
+import json
+import lzma
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from unittest import TestCase, mock, skipUnless
 from src.convert import extract_copy_numbers
 from src.convert import calculate_status
 from src.convert import gather_attributes
 from src.convert import calculate_interpretation
 from src.convert import extract_sample
+from src.convert import read_xml
+from src.convert import parse_position
+from src.convert import load_mappings
+from src.convert import pop_unresolved_values
+from src.convert import write_copy_numbers_to_cnv
+from src.convert import write_csv
+from src.convert import iter_copy_numbers
+from src.convert import report_has_copy_numbers
+from src.convert import contains_copy_numbers
+from src.convert import convert_report
+from src.interning import interner
+from src.interning import interning
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 
 expected_results = {
     'CopyNumbers': [{
@@ -395,6 +423,11 @@ class ConvertTest(TestCase):
         self.maxDiff = None
         self.assertDictEqual(expected_results_multiple_samples, cnv_resources)
 
+    def test_iter_copy_numbers(self):
+        copy_numbers = iter_copy_numbers(foundation_source_dict)
+        self.assertEqual(expected_results['CopyNumbers'][0], next(copy_numbers))
+        self.assertEqual(expected_results['CopyNumbers'][1:], list(copy_numbers))
+
     def test_calculate_status(self):
         self.assertEqual('gain', calculate_status('true', 'amplification'))
         self.assertEqual('amplification', calculate_status('false', 'amplification'))
@@ -404,6 +437,28 @@ class ConvertTest(TestCase):
         self.assertEqual('gain', calculate_status('true', 'partial amplification'))
         self.assertEqual('', calculate_status('true', 'fred'))
 
+    def test_calculate_status_counts_unresolved_values(self):
+        pop_unresolved_values()
+        calculate_status('true', 'fred')
+        calculate_status('true', 'fred')
+        calculate_interpretation('fred')
+        self.assertEqual({'copy type: fred, equivocal: true': 2, 'interpretation: fred': 1}, pop_unresolved_values())
+        self.assertEqual({}, pop_unresolved_values())
+
+    def test_load_mappings(self):
+        mapping_file = os.path.join(DATA_DIR, 'mappings.json')
+        status_map, interpretation_map = load_mappings(mapping_file)
+        self.assertEqual('amplified', calculate_status('false', 'amplification', status_map))
+        self.assertEqual('gain', calculate_status('true', 'amplification', status_map))
+        self.assertEqual('deletion', calculate_status('false', 'homozygous deletion', status_map))
+        self.assertEqual('Benign', calculate_interpretation('benign', interpretation_map))
+        self.assertEqual('Pathogenic', calculate_interpretation('known', interpretation_map))
+
+        # The cached maps are shared by every caller, so they cannot be changed in place
+        with self.assertRaises(TypeError):
+            load_mappings()[1]['known'] = 'Benign'
+        self.assertEqual('Pathogenic', calculate_interpretation('known', load_mappings()[1]))
+
     def test_calculate_interpretation(self):
         self.assertEqual('Pathogenic', calculate_interpretation('known'))
         self.assertEqual('Likely pathogenic', calculate_interpretation('likely'))
@@ -411,6 +466,15 @@ class ConvertTest(TestCase):
         self.assertEqual('other', calculate_interpretation('ambiguous'))
         self.assertEqual('', calculate_interpretation('fred'))
 
+    def test_parse_position(self):
+        self.assertEqual(('chr12', '58093932', '58188144'), parse_position('chr12:58093932-58188144'))
+        self.assertEqual(('chr12', 58093932, 58188144), parse_position('chr12:58093932-58188144', as_int=True))
+
+    def test_parse_position_invalid(self):
+        for position in ['chr12', 'chr12:58093932', 'chr12:a-b', '', None]:
+            with self.assertRaisesRegex(ValueError, 'for gene CDK4'):
+                parse_position(position, 'CDK4')
+
     def test_gather_attributes_with_partial_amplification(self):
         copy_number = {
             '@gene': 'RAD21',
@@ -542,3 +606,254 @@ class ConvertTest(TestCase):
             }
         }
         self.assertEquals('SA-1612348', extract_sample(samples))
+
+    def test_read_xml_streaming(self):
+        for report in ['foundation_report.xml', 'foundation_report_no_copy_numbers.xml']:
+            xml_file = os.path.join(DATA_DIR, report)
+            xml_dict = read_xml(xml_file)
+            streamed_dict = read_xml(xml_file, stream=True)
+            self.assertEqual(
+                extract_copy_numbers(xml_dict['rr:ResultsReport']['rr:ResultsPayload']),
+                extract_copy_numbers(streamed_dict['rr:ResultsReport']['rr:ResultsPayload']))
+
+    def test_read_xml_streaming_drops_other_sections(self):
+        streamed_dict = read_xml(os.path.join(DATA_DIR, 'foundation_report.xml'), stream=True)
+        variant_report = streamed_dict['rr:ResultsReport']['rr:ResultsPayload']['variant-report']
+        self.assertEqual(['samples', 'copy-number-alterations'], list(variant_report.keys()))
+        self.assertEqual(5, len(variant_report['copy-number-alterations']['copy-number-alteration']))
+
+    def test_read_xml_streaming_memory(self):
+        # The memory held while streaming does not grow with the base64 PDF payload
+        with open(os.path.join(DATA_DIR, 'foundation_report.xml')) as fd:
+            xml = fd.read()
+        payload = 'JVBERi0xLjQK' * (16 * 1024 * 1024 // 12)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xml_file = os.path.join(tmp_dir, 'large_payload.xml')
+            with open(xml_file, 'w') as fd:
+                fd.write(xml.replace('JVBERi0xLjQKJcfsj6IKNSAwIG9iago8PC9MZW5ndGggNiAwIFI+PgpzdHJlYW0K', payload))
+            del payload
+
+            tracemalloc.start()
+            try:
+                streamed_dict = read_xml(xml_file, stream=True)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        self.assertEqual(read_xml(os.path.join(DATA_DIR, 'foundation_report.xml'), stream=True), streamed_dict)
+        self.assertLess(peak, 2 * 1024 * 1024)
+
+    def test_write_csv(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            out_file = os.path.join(tmp_dir, 'out.csv')
+            write_copy_numbers_to_cnv(expected_results, argparse.Namespace(out_file=out_file, format='csv'))
+            with open(out_file) as fd:
+                lines = fd.read().splitlines()
+        self.assertEqual('sample_id,gene,copy_number,status,attributes,chromosome,start_position,end_position,'
+                         'interpretation', lines[0])
+        self.assertEqual('SA-1612348,CDK4,44.0,amplification,"{\'number-of-exons\': \'7 of 7\', \'ratio\': 11.63, '
+                         '\'interpretation\': \'known\', \'status\': \'amplification\'}",chr12,58093932,58188144,'
+                         'Pathogenic', lines[1])
+        self.assertEqual(6, len(lines))
+
+    def test_write_csv_concurrent_appends(self):
+        # The first writer holds the lock on a new file while the second one starts appending
+        locked, release = threading.Event(), threading.Event()
+
+        def held_rows():
+            locked.set()
+            release.wait()
+            yield from expected_results['CopyNumbers']
+
+        for name in ['out.csv', 'out.csv.gz']:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                out_file = os.path.join(tmp_dir, name)
+                first = threading.Thread(target=write_csv, args=(held_rows(), out_file), kwargs={'append': True})
+                second = threading.Thread(target=write_csv, args=(expected_results['CopyNumbers'], out_file),
+                                          kwargs={'append': True})
+                locked.clear()
+                release.clear()
+                first.start()
+                locked.wait()
+                second.start()
+                time.sleep(0.1)
+                release.set()
+                first.join()
+                second.join()
+                with (gzip.open(out_file, 'rt') if name.endswith('.gz') else open(out_file)) as fd:
+                    lines = fd.read().splitlines()
+            self.assertEqual(11, len(lines))
+            self.assertEqual(1, sum(line.startswith('sample_id,') for line in lines))
+
+    def test_write_ndjson(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            out_file = os.path.join(tmp_dir, 'out.ndjson')
+            write_copy_numbers_to_cnv(expected_results, argparse.Namespace(out_file=out_file, format='ndjson'))
+            with open(out_file) as fd:
+                records = [json.loads(line) for line in fd]
+        self.assertEqual(5, len(records))
+        self.assertEqual(58093932, records[0]['start_position'])
+        self.assertEqual(44.0, records[0]['copy_number'])
+        self.assertEqual(expected_results['CopyNumbers'][0]['attributes'], records[0]['attributes'])
+
+    @skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+    def test_write_parquet(self):
+        import pyarrow.parquet
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            out_file = os.path.join(tmp_dir, 'out.parquet')
+            write_copy_numbers_to_cnv(expected_results, argparse.Namespace(out_file=out_file, format='parquet'))
+            records = pyarrow.parquet.read_table(out_file).to_pylist()
+        self.assertEqual(5, len(records))
+        self.assertEqual(58093932, records[0]['start_position'])
+        self.assertEqual('11.63', records[0]['attributes']['ratio'])
+
+    def test_report_has_copy_numbers(self):
+        self.assertTrue(report_has_copy_numbers(os.path.join(DATA_DIR, 'foundation_report.xml')))
+        self.assertFalse(report_has_copy_numbers(os.path.join(DATA_DIR, 'foundation_report_no_copy_numbers.xml')))
+
+    def test_report_has_copy_numbers_compressed(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for report in ['foundation_report.xml', 'foundation_report_no_copy_numbers.xml']:
+                with open(os.path.join(DATA_DIR, report), 'rb') as fd:
+                    xml_bytes = fd.read()
+                xml_file = os.path.join(tmp_dir, report + '.gz')
+                with gzip.open(xml_file, 'wb') as fd:
+                    fd.write(xml_bytes)
+                # Small chunks split the elements across reads
+                with mock.patch('src.convert.PRESCAN_CHUNK_SIZE', 7):
+                    self.assertEqual(report == 'foundation_report.xml', report_has_copy_numbers(xml_file))
+
+    def test_read_compressed_xml(self):
+        xml_file = os.path.join(DATA_DIR, 'foundation_report.xml')
+        with open(xml_file, 'rb') as fd:
+            xml_bytes = fd.read()
+        expected = extract_copy_numbers(read_xml(xml_file)['rr:ResultsReport']['rr:ResultsPayload'])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xml_files = []
+            for extension, opener in [('.gz', gzip.open), ('.bz2', bz2.open), ('.xz', lzma.open)]:
+                xml_files.append(os.path.join(tmp_dir, 'report.xml' + extension))
+                with opener(xml_files[-1], 'wb') as fd:
+                    fd.write(xml_bytes)
+            with zipfile.ZipFile(os.path.join(tmp_dir, 'reports.zip'), 'w') as zip_file:
+                zip_file.writestr('nested/report.xml', xml_bytes)
+                zip_file.writestr('report.xml.gz', gzip.compress(xml_bytes))
+            xml_files += [os.path.join(tmp_dir, 'reports.zip::nested/report.xml'),
+                          os.path.join(tmp_dir, 'reports.zip::report.xml.gz')]
+
+            for xml_file in xml_files:
+                for stream, parser in [(False, 'xmltodict'), (True, 'xmltodict'), (False, 'expat')]:
+                    xml_dict = read_xml(xml_file, stream, parser)
+                    self.assertEqual(expected, extract_copy_numbers(xml_dict['rr:ResultsReport']['rr:ResultsPayload']))
+
+    def test_contains_copy_numbers(self):
+        self.assertFalse(contains_copy_numbers(b'<copy-number-alterations/>'))
+        self.assertFalse(contains_copy_numbers(b'<copy-number-alterations>\n</copy-number-alterations>'))
+        self.assertTrue(contains_copy_numbers(b'<copy-number-alteration gene="CDK4"/>'))
+        self.assertTrue(contains_copy_numbers(b'<vr:copy-number-alteration>'))
+        self.assertTrue(contains_copy_numbers('<copy-number-alterations/>'.encode('utf-16')))
+
+    def write_multi_sample_report(self, tmp_dir):
+        # CDK4 gains a second DNA sample and RNA evidence; the normal sample is listed in the samples block
+        with open(os.path.join(DATA_DIR, 'foundation_report.xml')) as fd:
+            xml = fd.read()
+        xml = xml.replace('</samples>', '  <sample name="SA-NORMAL" nucleic-acid-type="DNA"/>\n      </samples>')
+        xml = xml.replace('type="amplification">\n          <dna-evidence sample="SA-1612348"/>',
+                          'type="amplification">\n          <dna-evidence sample="SA-1612348"/>'
+                          '<dna-evidence sample="SA-NORMAL"/><rna-evidence sample="SA-1612349"/>', 1)
+        xml_file = os.path.join(tmp_dir, 'multi_sample.xml')
+        with open(xml_file, 'w') as fd:
+            fd.write(xml)
+        return xml_file
+
+    def test_extract_copy_numbers_all_samples(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xml_file = self.write_multi_sample_report(tmp_dir)
+            single_sample = read_xml(os.path.join(DATA_DIR, 'foundation_report.xml'))
+            for stream, parser in [(False, 'xmltodict'), (True, 'xmltodict'), (False, 'expat')]:
+                payload = read_xml(xml_file, stream, parser)['rr:ResultsReport']['rr:ResultsPayload']
+                # The default mode keeps the first DNA evidence sample
+                self.assertEqual(extract_copy_numbers(single_sample['rr:ResultsReport']['rr:ResultsPayload']),
+                                 extract_copy_numbers(payload))
+
+                rows = extract_copy_numbers(payload, every_sample=True)['CopyNumbers']
+                self.assertEqual([('CDK4', 'SA-1612348', 'DNA'), ('CDK4', 'SA-NORMAL', 'DNA'),
+                                  ('CDK4', 'SA-1612349', 'RNA')],
+                                 [(cnv['gene'], cnv['sample_id'], cnv['nucleic_acid_type']) for cnv in rows[:3]])
+                self.assertEqual(7, len(rows))
+                self.assertEqual(('RAD21', 'SA-1612348', 'DNA'),
+                                 (rows[-1]['gene'], rows[-1]['sample_id'], rows[-1]['nucleic_acid_type']))
+                self.assertEqual(rows[0]['attributes'], rows[2]['attributes'])
+                self.assertIsNot(rows[0]['attributes'], rows[2]['attributes'])
+
+    def test_write_split_samples(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xml_file = self.write_multi_sample_report(tmp_dir)
+            out_file = os.path.join(tmp_dir, 'report.csv.gz')
+            convert_report(xml_file, argparse.Namespace(out_file=out_file, format='csv', samples='all',
+                                                        split_samples=True, prescan=False, mapping_file=None,
+                                                        cache_dir=None, stream=False, parser='xmltodict'))
+
+            self.assertEqual(['multi_sample.xml', 'report.SA-1612348.csv.gz', 'report.SA-1612349.csv.gz',
+                              'report.SA-NORMAL.csv.gz'], sorted(os.listdir(tmp_dir)))
+            with gzip.open(os.path.join(tmp_dir, 'report.SA-1612349.csv.gz'), 'rt') as fd:
+                lines = fd.read().splitlines()
+            self.assertTrue(lines[0].endswith(',interpretation,nucleic_acid_type'))
+            self.assertEqual(2, len(lines))
+            self.assertTrue(lines[1].startswith('SA-1612349,CDK4,44.0,amplification,'))
+
+    def test_interning(self):
+        xml_file = os.path.join(DATA_DIR, 'foundation_report.xml')
+        payload, other_payload = [read_xml(xml_file)['rr:ResultsReport']['rr:ResultsPayload'] for _ in range(2)]
+        self.assertIsNot(extract_copy_numbers(payload)['CopyNumbers'][0]['gene'],
+                         extract_copy_numbers(other_payload)['CopyNumbers'][0]['gene'])
+
+        with interning():
+            rows = extract_copy_numbers(payload)['CopyNumbers']
+            other_rows = extract_copy_numbers(other_payload)['CopyNumbers']
+            self.assertIs(other_payload['variant-report']['samples'], interner.last_samples[0])
+
+            # Another pass over the same samples block reuses the resolved name
+            resolve = mock.Mock(side_effect=AssertionError)
+            self.assertEqual('SA-1612348', interner.resolve_sample(other_payload['variant-report'], resolve))
+            self.assertEqual('SA-1612348', interner.resolve_sample(payload['variant-report'], extract_sample))
+            self.assertIs(payload['variant-report']['samples'], interner.last_samples[0])
+        self.assertEqual(expected_results['CopyNumbers'][0]['gene'], rows[0]['gene'])
+        self.assertEqual(extract_copy_numbers(payload)['CopyNumbers'], rows)
+        self.assertIs(rows[0]['gene'], other_rows[0]['gene'])
+        self.assertIs(rows[0]['sample_id'], other_rows[1]['sample_id'])
+        self.assertIs(rows[0]['attributes']['status'], other_rows[0]['attributes']['status'])
+        self.assertEqual(0, len(interner))
+        self.assertFalse(interner.enabled)
+
+    def test_import_has_no_side_effects(self):
+        # Importing must neither configure logging nor load xmltodict, which is only needed to parse
+        output = subprocess.run(
+            [sys.executable, '-c', 'import logging, sys, src.convert; '
+                                   'print(len(logging.root.handlers), "xmltodict" in sys.modules)'],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), stdout=subprocess.PIPE,
+            universal_newlines=True, check=True).stdout
+        self.assertEqual('0 False', output.strip())
+
+    def test_run_as_script(self):
+        # The Docker image used to run python src/convert.py directly, which must keep working
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            out_file = os.path.join(tmp_dir, 'out.csv')
+            output = subprocess.run([sys.executable, os.path.join('src', 'convert.py'), '-x',
+                                     os.path.join(DATA_DIR, 'foundation_report.xml'), '-o', out_file],
+                                    cwd=root_dir, stderr=subprocess.PIPE, check=True, universal_newlines=True)
+            with open(out_file) as fd:
+                self.assertEqual(6, len(fd.readlines()))
+        # The script hands over to the package, so the conversion runs in src.convert rather than __main__
+        self.assertIn('[src.convert.main:', output.stderr)
+        self.assertNotIn('[__main__.', output.stderr)
+
+    def test_read_xml_expat(self):
+        for report in ['foundation_report.xml', 'foundation_report_no_copy_numbers.xml']:
+            xml_file = os.path.join(DATA_DIR, report)
+            xml_dict = read_xml(xml_file)
+            expat_dict = read_xml(xml_file, parser='expat')
+            self.assertEqual(
+                extract_copy_numbers(xml_dict['rr:ResultsReport']['rr:ResultsPayload']),
+                extract_copy_numbers(expat_dict['rr:ResultsReport']['rr:ResultsPayload']))
+            self.assertEqual(read_xml(xml_file, stream=True), expat_dict)
@@ -0,0 +1,113 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+from unittest import TestCase, mock
+from src.batch import convert_batch
+from src.batch import find_reports
+from src.index import IntervalIndex
+from src.index import build_index
+from src.index import parse_region
+from src.table import positions
+from test.batch_tests import batch_args
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def random_calls(count, seed=0):
+    rng = random.Random(seed)
+    calls = []
+    for i in range(count):
+        start = rng.randrange(1, 1000000)
+        # A few very long calls, like whole-arm losses, must not hide the short calls after them
+        length = rng.randrange(1, 1000) if i % 50 else rng.randrange(1, 500000)
+        calls.append({'sample_id': 'SA-%d' % (i % 7), 'gene': 'GENE%d' % (i % 40), 'copy_number': 2.0,
+                      'status': rng.choice(['amplification', 'loss']), 'attributes': {},
+                      'chromosome': rng.choice(['chr1', 'chr2', 'chrX']), 'start_position': str(start),
+                      'end_position': str(start + length), 'interpretation': 'Pathogenic'})
+    return calls
+
+
+class CountingArray(object):
+
+    def __init__(self, column):
+        self.column = column
+        self.reads = 0
+
+    def __getitem__(self, index):
+        self.reads += 1
+        return self.column[index]
+
+
+class IndexTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_overlapping_matches_linear_scan(self):
+        calls = random_calls(2000)
+        index = IntervalIndex.build(calls)
+        rng = random.Random(1)
+        for _ in range(200):
+            chromosome = rng.choice(['chr1', 'chr2', 'chrX', 'chrY'])
+            start = rng.randrange(1, 1000000)
+            end = start + rng.randrange(0, 20000)
+            expected = sorted((cnv['start_position'], cnv['gene']) for cnv in calls
+                              if cnv['chromosome'] == chromosome and int(cnv['start_position']) <= end
+                              and int(cnv['end_position']) >= start)
+            found = sorted((cnv['start_position'], cnv['gene']) for cnv in index.overlapping(chromosome, start, end))
+            self.assertEqual(expected, found)
+
+    def test_long_call_does_not_widen_queries(self):
+        calls = [dict(cnv, chromosome='chr1') for cnv in random_calls(2000)]
+        calls[0] = dict(calls[0], start_position='1', end_position='2000000')
+        index = IntervalIndex.build(calls)
+
+        # Count the rows a query looks at: the long call's bin and the short rows near the query only
+        ends = index.table.columns['end_position']
+        index.table.columns['end_position'] = CountingArray(ends)
+        rows = index.overlapping_rows('chr1', 900000, 900100)
+        self.assertEqual(sorted(row for row in range(len(index)) if ends[row] >= 900000
+                                and index.table.columns['start_position'][row] <= 900100), rows)
+        self.assertLess(index.table.columns['end_position'].reads, 100)
+
+    def test_gene(self):
+        calls = random_calls(500)
+        index = IntervalIndex.build(calls)
+        self.assertEqual(sorted(cnv['start_position'] for cnv in calls if cnv['gene'] == 'GENE3'),
+                         sorted(cnv['start_position'] for cnv in index.gene('GENE3')))
+        self.assertEqual(0, len(index.gene('EGFR')))
+
+        # A lookup only searches for the requested gene, not every gene of the index
+        with mock.patch('src.index.positions', wraps=positions) as search:
+            self.assertEqual(len(index.gene('GENE3')), len(index.gene_rows('GENE3')))
+        self.assertEqual(2, search.call_count)
+
+    def test_parse_region(self):
+        self.assertEqual(('chr12', 58000000, 58200000), parse_region('chr12:58,000,000-58,200,000'))
+        self.assertEqual(('chr12', 0, sys.maxsize), parse_region('chr12'))
+        with self.assertRaises(ValueError):
+            parse_region('chr12:58000000')
+
+    def test_build_index_from_outputs(self):
+        for output_format in ['csv', 'ndjson', 'table']:
+            out_dir = os.path.join(self.tmp_dir, output_format)
+            os.makedirs(out_dir)
+            reports = find_reports(DATA_DIR, out_dir, '.' + output_format)
+            convert_batch(reports, batch_args(format=output_format))
+
+            index_file = os.path.join(self.tmp_dir, output_format + '.index')
+            build_index([out_file for _, out_file in reports]).save(index_file)
+            index = IntervalIndex.load(index_file)
+
+            self.assertEqual(5, len(index))
+            calls = list(index.overlapping('chr12', 58000000, 58200000))
+            self.assertEqual(['CDK4'], [cnv['gene'] for cnv in calls])
+            self.assertEqual(reports[0][1], calls[0]['source_file'])
+            self.assertEqual({'number-of-exons': '7 of 7', 'status': 'amplification', 'ratio': '11.63',
+                              'interpretation': 'known'}, calls[0]['attributes'])
+            self.assertEqual(['MYC'], [cnv['gene'] for cnv in index.gene('MYC')])
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from src.journal import Journal
+
+
+class JournalTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.xml_file = os.path.join(self.tmp_dir, 'report.xml')
+        self.out_file = os.path.join(self.tmp_dir, 'report.csv')
+        with open(self.xml_file, 'w') as fd:
+            fd.write('<report/>')
+        with open(self.out_file, 'w') as fd:
+            fd.write('header\n')
+        self.journal = Journal(os.path.join(self.tmp_dir, 'journal.sqlite'))
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def record(self, status):
+        self.journal.record({'xml_file': self.xml_file, 'out_file': self.out_file, 'status': status, 'error': ''})
+
+    def test_new_and_failed_reports_are_pending(self):
+        self.assertFalse(self.journal.is_converted(self.xml_file, self.out_file))
+        self.record('failure')
+        self.assertFalse(self.journal.is_converted(self.xml_file, self.out_file))
+        self.record('success')
+        self.assertTrue(self.journal.is_converted(self.xml_file, self.out_file))
+        self.assertFalse(self.journal.is_converted(self.xml_file, self.out_file + '.other'))
+
+    def test_changed_reports_are_pending(self):
+        self.record('success')
+        later = time.time() + 10
+        os.utime(self.xml_file, (later, later))
+        self.assertTrue(self.journal.is_converted(self.xml_file, self.out_file))
+
+        with open(self.xml_file, 'w') as fd:
+            fd.write('<rep0rt/>')
+        os.utime(self.xml_file, (later, later))
+        self.assertFalse(self.journal.is_converted(self.xml_file, self.out_file))
+
+    def test_missing_output_is_pending(self):
+        self.record('success')
+        os.unlink(self.out_file)
+        self.assertEqual([(self.xml_file, self.out_file)], self.journal.pending([(self.xml_file, self.out_file)]))
+
+    def test_journal_persists(self):
+        self.record('success')
+        self.journal.close()
+        self.journal = Journal(os.path.join(self.tmp_dir, 'journal.sqlite'))
+        self.assertTrue(self.journal.is_converted(self.xml_file, self.out_file))
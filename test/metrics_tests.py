@@ -0,0 +1,45 @@
+import time
+from unittest import TestCase
+from src.metrics import Metrics
+
+
+class MetricsTest(TestCase):
+
+    def test_disabled_metrics_record_nothing(self):
+        metrics = Metrics()
+        items = [1, 2, 3]
+        with metrics.timer('stage'):
+            metrics.increment('counter')
+        self.assertIs(items, metrics.timed('stage', items))
+        self.assertEqual({'stages': {}, 'counters': {}}, metrics.to_dict())
+
+    def test_nested_timers_are_exclusive(self):
+        metrics = Metrics()
+        metrics.enable()
+
+        def slow_items():
+            time.sleep(0.05)
+            yield 1
+            yield 2
+
+        with metrics.timer('outer'):
+            for _ in metrics.timed('inner', slow_items(), 'items'):
+                pass
+
+        summary = metrics.to_dict()
+        self.assertEqual(3, summary['stages']['inner']['calls'])
+        self.assertEqual(1, summary['stages']['outer']['calls'])
+        self.assertGreaterEqual(summary['stages']['inner']['seconds'], 0.05)
+        self.assertLess(summary['stages']['outer']['seconds'], 0.05)
+        self.assertEqual({'items': 2}, summary['counters'])
+
+    def test_merge_and_prometheus(self):
+        metrics = Metrics()
+        metrics.merge({'stages': {'read_xml': {'seconds': 0.5, 'calls': 2}}, 'counters': {'bytes_read': 100}})
+        metrics.merge({'stages': {'read_xml': {'seconds': 0.25, 'calls': 1}}, 'counters': {'bytes_read': 20}})
+        self.assertEqual('# TYPE foundation_xml_cnv_stage_seconds_total counter\n'
+                         'foundation_xml_cnv_stage_seconds_total{stage="read_xml"} 0.750000\n'
+                         '# TYPE foundation_xml_cnv_stage_calls_total counter\n'
+                         'foundation_xml_cnv_stage_calls_total{stage="read_xml"} 3\n'
+                         '# TYPE foundation_xml_cnv_bytes_read_total counter\n'
+                         'foundation_xml_cnv_bytes_read_total 120\n', metrics.to_prometheus())
@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from src.convert import convert_report
+from src.convert import read_xml
+from src.sections import iter_biomarkers
+from src.sections import iter_rearrangements
+from src.sections import iter_short_variants
+from src.sections import read_sections
+from src.sections import section_output
+from src.sections import xml_sections
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+ALL_SECTIONS = ['copy-numbers', 'short-variants', 'rearrangements', 'biomarkers']
+
+
+def section_args(out_file, sections=ALL_SECTIONS, **kwargs):
+    return argparse.Namespace(**dict(dict(out_file=out_file, format='csv', stream=False, parser='xmltodict',
+                                          prescan=False, mapping_file=None, cache_dir=None, sections=sections),
+                                     **kwargs))
+
+
+class SectionsTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.xml_file = os.path.join(DATA_DIR, 'foundation_report.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_extract_sections(self):
+        payload = read_xml(self.xml_file)['rr:ResultsReport']['rr:ResultsPayload']
+
+        self.assertEqual([{'sample_id': 'SA-1612348', 'gene': 'KRAS', 'chromosome': 'chr12', 'position': '25398284',
+                           'cds_effect': '229C>A', 'protein_effect': 'G12C', 'functional_effect': 'missense',
+                           'transcript': 'NM_004985', 'allele_fraction': '0.488', 'depth': '200', 'status': 'known',
+                           'interpretation': 'Pathogenic'}], list(iter_short_variants(payload)))
+        rearrangements = list(iter_rearrangements(payload))
+        self.assertEqual(1, len(rearrangements))
+        self.assertEqual(('CDK4', 'truncation', 'chr17:29557687-29887856', 'Pathogenic'),
+                         tuple(rearrangements[0][field] for field in ['targeted_gene', 'type', 'pos1',
+                                                                      'interpretation']))
+        self.assertEqual([('microsatellite-instability', 'MSS', None), ('tumor-mutation-burden', 'low', '3.78')],
+                         [(b['biomarker'], b['status'], b['score']) for b in iter_biomarkers(payload)])
+
+    def test_read_sections_parsers_agree(self):
+        expected = {section: list(rows) for section, rows in
+                    read_sections(self.xml_file, ALL_SECTIONS, section_args('-')).items()}
+        self.assertEqual(ALL_SECTIONS, list(expected))
+        self.assertEqual(5, len(expected['copy-numbers']))
+
+        for kwargs in [{'parser': 'expat'}, {'stream': True}]:
+            sections = read_sections(self.xml_file, ALL_SECTIONS, section_args('-', **kwargs))
+            self.assertEqual(expected, {section: list(rows) for section, rows in sections.items()})
+
+        # The streaming parsers only keep the samples and the requested sections
+        xml_dict = read_xml(self.xml_file, parser='expat', sections=xml_sections(['biomarkers']))
+        self.assertEqual(['samples', 'biomarkers'],
+                         list(xml_dict['rr:ResultsReport']['rr:ResultsPayload']['variant-report']))
+
+    def test_convert_report_sections(self):
+        out_file = os.path.join(self.tmp_dir, 'report.ndjson')
+        convert_report(self.xml_file, section_args(out_file, format='ndjson'))
+
+        self.assertEqual(sorted(['report.ndjson', 'report.short-variants.ndjson', 'report.rearrangements.ndjson',
+                                 'report.biomarkers.ndjson']), sorted(os.listdir(self.tmp_dir)))
+        with open(section_output(out_file, 'biomarkers')) as fd:
+            biomarkers = [json.loads(line) for line in fd]
+        self.assertEqual({'sample_id': 'SA-1612348', 'biomarker': 'tumor-mutation-burden', 'status': 'low',
+                          'score': '3.78', 'unit': 'mutations-per-megabase'}, biomarkers[1])
+
+        # Without copy-numbers only the other sections are written
+        shutil.rmtree(self.tmp_dir)
+        os.mkdir(self.tmp_dir)
+        convert_report(self.xml_file, section_args(os.path.join(self.tmp_dir, 'report.csv.gz'), ['short-variants']))
+        self.assertEqual(['report.short-variants.csv.gz'], os.listdir(self.tmp_dir))
+
+        with self.assertRaises(ValueError):
+            convert_report(self.xml_file, section_args('-', ['short-variants']))
+        with self.assertRaises(ValueError):
+            convert_report(self.xml_file, section_args(os.path.join(self.tmp_dir, 'report.table'), format='table'))
@@ -0,0 +1,104 @@
+import argparse
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from http.client import HTTPConnection
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from src.server import convert_xml
+from src.server import serve_http
+from src.server import serve_stdio
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def read_report(name='foundation_report.xml'):
+    with open(os.path.join(DATA_DIR, name), 'rb') as fd:
+        return fd.read()
+
+
+class ServerTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_convert_xml(self):
+        lines = convert_xml(read_report(), 'csv').decode('utf-8').splitlines()
+        self.assertEqual(6, len(lines))
+        self.assertTrue(lines[1].startswith('SA-1612348,CDK4,44.0,amplification,'))
+
+        records = [json.loads(line) for line in convert_xml(read_report(), 'ndjson').splitlines()]
+        self.assertEqual(['CDK4', 'CCND3', 'MYC', 'PIM1', 'RAD21'], [record['gene'] for record in records])
+
+    def test_serve_http(self):
+        server = serve_http('127.0.0.1', 0, self.executor)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:%d' % server.server_port
+        try:
+            with urlopen(url + '/convert?format=csv', data=read_report()) as response:
+                self.assertEqual('text/csv', response.headers['Content-Type'])
+                self.assertEqual(convert_xml(read_report(), 'csv'), response.read())
+
+            # Values the mappings do not cover are logged by the server and returned in a header
+            with self.assertLogs('src.convert', 'ERROR') as logs:
+                with urlopen(url + '/convert', data=read_report().replace(b'status="known"', b'status="odd"')) \
+                        as response:
+                    self.assertEqual({'interpretation: odd': 2}, json.loads(response.headers['X-Unresolved-Values']))
+            self.assertEqual(['Failed to resolve interpretation: odd (2 alterations)'],
+                             [record.getMessage() for record in logs.records])
+
+            with self.assertRaises(HTTPError) as context:
+                urlopen(url + '/convert', data=b'<rr:ResultsReport>')
+            self.assertEqual(400, context.exception.code)
+
+            connection = HTTPConnection('127.0.0.1', server.server_port)
+            connection.putrequest('POST', '/convert')
+            connection.putheader('Content-Length', 'many')
+            connection.endheaders()
+            self.assertEqual(400, connection.getresponse().status)
+            connection.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_serve_stdio(self):
+        jobs = [{'id': 1, 'xml_file': os.path.join(DATA_DIR, 'foundation_report.xml'),
+                 'out_file': os.path.join(self.tmp_dir, 'report.csv')},
+                {'id': 2, 'xml_file': os.path.join(self.tmp_dir, 'missing.xml'),
+                 'out_file': os.path.join(self.tmp_dir, 'missing.csv')}]
+        stdin = io.StringIO(''.join(json.dumps(job) + '\n' for job in jobs))
+        stdout = io.StringIO()
+
+        args = argparse.Namespace(stream=False, mapping_file=None, format='csv', cache_dir=None,
+                                  prescan=False, parser='xmltodict')
+        serve_stdio(self.executor, args, stdin, stdout)
+
+        results = sorted((json.loads(line) for line in stdout.getvalue().splitlines()), key=lambda r: r['id'])
+        self.assertEqual(['success', 'failure'], [result['status'] for result in results])
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, 'report.csv')))
+
+    def test_serve_stdio_invalid_jobs(self):
+        job = {'id': 4, 'xml_file': os.path.join(DATA_DIR, 'foundation_report.xml'),
+               'out_file': os.path.join(self.tmp_dir, 'report.csv')}
+        stdin = io.StringIO('not json\n{"id": 2, "xml_file": "a.xml"}\n[1]\n{"id": 3, "xml_file": "a.xml", '
+                            '"out_file": "a.csv", "format": "xml"}\n' + json.dumps(job) + '\n')
+        stdout = io.StringIO()
+
+        args = argparse.Namespace(stream=False, mapping_file=None, format='csv', cache_dir=None,
+                                  prescan=False, parser='xmltodict')
+        serve_stdio(self.executor, args, stdin, stdout)
+
+        results = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual([None, 2, None, 3, 4], [result['id'] for result in results])
+        self.assertEqual(['failure'] * 4 + ['success'], [result['status'] for result in results])
+        self.assertIn('out_file', results[1]['error'])
@@ -0,0 +1,98 @@
+import argparse
+import math
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from src.convert import extract_copy_numbers
+from src.convert import read_xml
+from src.convert import write_copy_numbers_to_cnv
+from src.table import CopyNumberTable
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def read_rows():
+    xml_dict = read_xml(os.path.join(DATA_DIR, 'foundation_report.xml'))
+    return extract_copy_numbers(xml_dict['rr:ResultsReport']['rr:ResultsPayload'])['CopyNumbers']
+
+
+class TableTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.rows = read_rows()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        table = CopyNumberTable.from_dicts(self.rows)
+        self.assertEqual(5, len(table))
+        self.assertEqual(self.rows, list(table))
+
+        merged = [dict(cnv, source_file='a.xml') for cnv in self.rows[:2]] + self.rows[2:]
+        self.assertEqual(merged, list(CopyNumberTable.from_dicts(merged)))
+        samples = [dict(cnv, nucleic_acid_type='RNA') for cnv in self.rows]
+        self.assertEqual(samples, list(CopyNumberTable.from_dicts(samples)))
+
+    def test_ratio_round_trip(self):
+        ratios = ['2.10', 11.63, 'NA', '0.5', None, '1e-05', 'nan']
+        rows = [dict(self.rows[0], attributes=dict(self.rows[0]['attributes'], ratio=ratio)) for ratio in ratios]
+        rows[4]['attributes'].pop('ratio')
+        table = CopyNumberTable.from_dicts(rows)
+        self.assertEqual(rows, list(table))
+        self.assertEqual(11.63, table.columns['ratio'][1])
+        self.assertTrue(math.isnan(table.columns['ratio'][2]))
+
+        # Only values the float column does not reproduce are kept as text
+        self.assertEqual(['2.10', 11.63, 'NA', None, 'nan'], table.vocabularies['ratio_text'])
+        table_file = os.path.join(self.tmp_dir, 'ratios.table')
+        table.save(table_file)
+        self.assertEqual(rows, list(CopyNumberTable.load(table_file)))
+
+    def test_select(self):
+        table = CopyNumberTable.from_dicts(self.rows)
+        self.assertEqual(['CDK4'], [cnv['gene'] for cnv in table.select(gene='CDK4')])
+        self.assertEqual(['CDK4', 'MYC'], [cnv['gene'] for cnv in table.select(gene=['MYC', 'CDK4', 'EGFR'])])
+        self.assertEqual(0, len(table.select(gene='CDK4', status='loss')))
+        self.assertEqual(0, len(table.select(gene='EGFR')))
+        self.assertEqual(len(table), len(table.select()))
+
+    def test_overlapping(self):
+        table = CopyNumberTable.from_dicts(self.rows)
+        self.assertEqual(['CDK4'], [cnv['gene'] for cnv in table.overlapping('chr12', 58000000, 58100000)])
+        self.assertEqual(['CDK4'], [cnv['gene'] for cnv in table.overlapping('chr12', 58188144, 58200000)])
+        self.assertEqual(0, len(table.overlapping('chr12', 58188145, 58200000)))
+        self.assertEqual(0, len(table.overlapping('chrX', 0, 10 ** 9)))
+
+    def test_value_counts_and_concat(self):
+        table = CopyNumberTable.from_dicts(self.rows)
+        other = CopyNumberTable.from_dicts(dict(cnv, sample_id='SA-2') for cnv in reversed(self.rows))
+        table.concat(other)
+
+        self.assertEqual(10, len(table))
+        self.assertEqual({'SA-1612348': 5, 'SA-2': 5}, dict(table.value_counts('sample_id')))
+        self.assertEqual(2, table.value_counts('gene')['CDK4'])
+        self.assertEqual(self.rows + [dict(cnv, sample_id='SA-2') for cnv in reversed(self.rows)], list(table))
+
+    def test_save_and_load(self):
+        table_file = os.path.join(self.tmp_dir, 'report.table')
+        CopyNumberTable.from_dicts(self.rows).save(table_file)
+        self.assertEqual(self.rows, list(CopyNumberTable.load(table_file)))
+
+        # The table output format writes the same file through the usual writer path, compressed here
+        write_copy_numbers_to_cnv({'CopyNumbers': self.rows},
+                                  argparse.Namespace(out_file=table_file + '.gz', format='table'))
+        self.assertEqual(self.rows, list(CopyNumberTable.load(table_file + '.gz')))
+
+        # Tables written before the ratio text column give their ratios back from the float column
+        table = CopyNumberTable.from_dicts(self.rows)
+        del table.vocabularies['ratio_text'], table.columns['ratio_text']
+        table.save(table_file)
+        self.assertEqual(self.rows, list(CopyNumberTable.load(table_file)))
+
+        with open(table_file, 'wb') as fd:
+            fd.write(b'gene,status\n')
+        with self.assertRaises(ValueError):
+            CopyNumberTable.load(table_file)
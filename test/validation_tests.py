@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from src.batch import convert_batch
+from src.batch import convert_many_async
+from src.convert import convert_report
+from src.convert import extract_copy_numbers
+from src.convert import read_xml
+from src.validation import ValidationError
+from src.validation import pop_validation_errors
+from src.validation import report_validation_errors
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def write_invalid_report(tmp_dir):
+    # CCND3 gets a position without an end and MYC loses its copy number
+    with open(os.path.join(DATA_DIR, 'foundation_report.xml')) as fd:
+        xml = fd.read()
+    xml = xml.replace('position="chr6:41853880-41956362"', 'position="chr6:41853880"')
+    xml = xml.replace('copy-number="41" ', '')
+    xml_file = os.path.join(tmp_dir, 'invalid.xml')
+    with open(xml_file, 'w') as fd:
+        fd.write(xml)
+    return xml_file
+
+
+class ValidationTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.xml_file = write_invalid_report(self.tmp_dir)
+        pop_validation_errors()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_strict(self):
+        payload = read_xml(self.xml_file, parser='expat')['rr:ResultsReport']['rr:ResultsPayload']
+        with self.assertRaises(ValidationError) as context:
+            extract_copy_numbers(payload)
+
+        self.assertEqual([{'element': 'copy-number-alteration', 'index': 1, 'gene': 'CCND3', 'line': 28,
+                           'attribute': 'position', 'value': 'chr6:41853880',
+                           'problem': 'is not chromosome:start-end'}], context.exception.errors)
+        self.assertIn('gene CCND3, line 28', str(context.exception))
+        self.assertEqual([], pop_validation_errors())
+
+    def test_lenient(self):
+        expected = [('CCND3', 'position', 28), ('MYC', 'copy-number', 31)]
+        for kwargs, lines in [({}, False), ({'stream': True}, True), ({'parser': 'expat'}, True)]:
+            payload = read_xml(self.xml_file, **kwargs)['rr:ResultsReport']['rr:ResultsPayload']
+            rows = extract_copy_numbers(payload, validation='lenient')['CopyNumbers']
+            self.assertEqual(['CDK4', 'PIM1', 'RAD21'], [cnv['gene'] for cnv in rows])
+            errors = pop_validation_errors()
+            self.assertEqual([(gene, attribute, line if lines else None) for gene, attribute, line in expected],
+                             [(error['gene'], error['attribute'], error['line']) for error in errors])
+
+        # Unvalidated extraction still fails on the first bad element, without context
+        with self.assertRaises(ValueError):
+            extract_copy_numbers(payload, validation=None)
+
+    def test_lenient_skips_elements_without_attributes(self):
+        payload = read_xml(os.path.join(DATA_DIR, 'foundation_report.xml'))['rr:ResultsReport']['rr:ResultsPayload']
+        copy_numbers = payload['variant-report']['copy-number-alterations']
+        copy_numbers['copy-number-alteration'][1:1] = ['oops', None]
+
+        rows = extract_copy_numbers(payload, validation='lenient')['CopyNumbers']
+        self.assertEqual(5, len(rows))
+        errors = pop_validation_errors()
+        self.assertEqual([(index, attribute, 'is missing') for index in [1, 2]
+                          for attribute in ['copy-number', 'equivocal', 'gene', 'position', 'status', 'type']],
+                         [(error['index'], error['attribute'], error['problem']) for error in errors])
+        with self.assertRaises(ValidationError):
+            extract_copy_numbers(payload)
+
+    def test_validation_errors_file(self):
+        out_file = os.path.join(self.tmp_dir, 'invalid.csv')
+        errors_file = os.path.join(self.tmp_dir, 'errors.ndjson')
+        args = argparse.Namespace(out_file=out_file, format='csv', stream=False, parser='expat', prescan=False,
+                                  mapping_file=None, cache_dir=None, validate='lenient')
+        convert_report(self.xml_file, args)
+        report_validation_errors(pop_validation_errors(), errors_file)
+
+        with open(out_file) as fd:
+            self.assertEqual(4, len(fd.readlines()))
+        with open(errors_file) as fd:
+            errors = [json.loads(line) for line in fd]
+        self.assertEqual(['CCND3', 'MYC'], [error['gene'] for error in errors])
+        self.assertEqual({'element': 'copy-number-alteration', 'index': 2, 'gene': 'MYC', 'line': 31,
+                          'attribute': 'copy-number', 'value': None, 'problem': 'is missing'}, errors[1])
+
+    def test_batch(self):
+        reports = [(self.xml_file, os.path.join(self.tmp_dir, 'invalid.csv'))]
+        args = argparse.Namespace(format='csv', stream=False, parser='xmltodict', prescan=False, mapping_file=None,
+                                  cache_dir=None, jobs=1, validate='strict')
+        result, = convert_batch(reports, args)
+        self.assertEqual('failure', result['status'])
+        self.assertIn('gene CCND3', result['error'])
+
+        result, = convert_batch(reports, argparse.Namespace(**dict(vars(args), validate='lenient')))
+        self.assertEqual('success', result['status'])
+        self.assertEqual(['CCND3', 'MYC'], [error['gene'] for error in result['invalid']])
+
+    def test_async_errors_belong_to_their_report(self):
+        valid_file = os.path.join(DATA_DIR, 'foundation_report.xml')
+        reports = [(valid_file, os.path.join(self.tmp_dir, 'valid.csv')),
+                   (self.xml_file, os.path.join(self.tmp_dir, 'invalid.csv'))]
+        args = argparse.Namespace(format='csv', stream=False, parser='xmltodict', prescan=False, mapping_file=None,
+                                  cache_dir=None, jobs=1, validate='lenient')
+        for _ in range(3):
+            results = asyncio.run(convert_many_async(reports, args, concurrency=2))
+            self.assertEqual([valid_file, self.xml_file], [result['xml_file'] for result in results])
+            self.assertEqual([[], ['CCND3', 'MYC']],
+                             [[error['gene'] for error in result['invalid']] for result in results])
+            self.assertEqual([{}, {}], [result['unresolved'] for result in results])